@@ -21,33 +21,43 @@ WeCafe Shift & Tasks Bot (Telegram) — версия под сценарий Dre
 
 from __future__ import annotations
 
+import asyncio
 import base64
-import json
-import html
 import logging
 import os
+import re
 import threading
 from io import BytesIO
-from dataclasses import dataclass
+from time import monotonic
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, replace
+from functools import lru_cache, partial
 from datetime import datetime, date, time, timedelta
-from http.server import BaseHTTPRequestHandler, HTTPServer
-from typing import Dict, List, Optional, Tuple, Any
+from typing import Dict, List, Optional, Sequence, Tuple, Any
+from zoneinfo import ZoneInfo
 
-import pytz
+import orjson
 from aiohttp import web
 from dotenv import load_dotenv
+import httplib2
 from google.oauth2 import service_account
+from google_auth_httplib2 import AuthorizedHttp
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
+from googleapiclient.model import JsonModel
 from telegram import (
     InlineKeyboardButton,
     InlineKeyboardMarkup,
+    InputMediaPhoto,
     ReplyKeyboardRemove,
     Update,
 )
 from telegram.constants import ChatType
+from telegram.error import BadRequest, RetryAfter
 from telegram.ext import (
+    AIORateLimiter,
     Application,
+    BaseUpdateProcessor,
     CallbackQueryHandler,
     CommandHandler,
     ContextTypes,
@@ -71,13 +81,20 @@ TIME_ZONE = os.getenv("TIME_ZONE", "Asia/Krasnoyarsk").strip()
 
 CONTROL_GROUP_ID = int(os.getenv("CONTROL_GROUP_ID", "0").strip() or "0")
 REPORT_TO_CONTROL = os.getenv("REPORT_TO_CONTROL", "1").strip() != "0"
+# после N сбоев подряд отправки в контроль на T секунд пропускаем (не копим обречённые запросы)
+CONTROL_BREAKER_FAILURES = int(os.getenv("CONTROL_BREAKER_FAILURES", "5").strip() or "5")
+CONTROL_BREAKER_SECONDS = int(os.getenv("CONTROL_BREAKER_SECONDS", "60").strip() or "60")
 
 ACCESS_CODE = os.getenv("ACCESS_CODE", "DreamTeam").strip()
 
-# Webhook (Render)
-WEBHOOK_MODE = os.getenv("WEBHOOK_MODE", "0").strip() == "1"
+# Webhook (Render): если задан WEBHOOK_BASE_URL — по умолчанию работаем через webhook, иначе polling
 WEBHOOK_BASE_URL = os.getenv("WEBHOOK_BASE_URL", "").strip().rstrip("/")
+WEBHOOK_MODE = os.getenv("WEBHOOK_MODE", "1" if WEBHOOK_BASE_URL else "0").strip() == "1"
 WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "webhook").strip().lstrip("/")
+# Telegram присылает его в заголовке X-Telegram-Bot-Api-Secret-Token; чужие запросы отбрасываем
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "").strip()
+# бот обрабатывает только сообщения и нажатия кнопок — остальные типы апдейтов Telegram фильтрует у себя
+ALLOWED_UPDATES = ["message", "callback_query"]
 
 # Health
 ENABLE_HEALTH = os.getenv("ENABLE_HEALTH", "1").strip() != "0"
@@ -88,6 +105,7 @@ HEALTH_PORT = int(os.getenv("HEALTH_PORT", "8080").strip() or "8080")
 ENABLE_REMINDERS = os.getenv("ENABLE_REMINDERS", "1").strip() != "0"
 REMINDER_CHECK_MINUTES = int(os.getenv("REMINDER_CHECK_MINUTES", "10").strip() or "10")  # проверяем чаще, пинаем раз в час
 REMINDER_IDLE_MINUTES = int(os.getenv("REMINDER_IDLE_MINUTES", "60").strip() or "60")
+REMINDER_IDLE = timedelta(minutes=REMINDER_IDLE_MINUTES)
 
 # Ежедневные итоги (в группу контроля)
 ENABLE_DAILY_TOTALS = os.getenv("ENABLE_DAILY_TOTALS", "1").strip() != "0"
@@ -104,6 +122,25 @@ SHEET_DONE = os.getenv("SHEET_DONE", "done_log").strip()                # отм
 SHEET_SESSIONS = os.getenv("SHEET_SESSIONS", "shift_sessions").strip()  # состояния смен
 SHEET_CLOSE = os.getenv("SHEET_CLOSE", "close_log").strip()             # закрытие смены (цифры + фото)
 
+# Кэш листа users в памяти (сек). Свои записи сбрасывают кэш сразу, TTL — для правок руками в таблице.
+USERS_CACHE_TTL_SECONDS = int(os.getenv("USERS_CACHE_TTL_SECONDS", "30").strip() or "30")
+SESSIONS_CACHE_TTL_SECONDS = int(os.getenv("SESSIONS_CACHE_TTL_SECONDS", "30").strip() or "30")
+# График уборки меняют редко и только руками в таблице
+SCHEDULE_CACHE_TTL_SECONDS = int(os.getenv("SCHEDULE_CACHE_TTL_SECONDS", "300").strip() or "300")
+POINTS_CACHE_TTL_SECONDS = int(os.getenv("POINTS_CACHE_TTL_SECONDS", "300").strip() or "300")
+# done_log читают на каждом показе плана/отметки. Свои отметки видны сразу (очередь записи + дочитывание
+# хвоста после flush), а ручные правки листа (удаление/правка строк) подхватываются полным перечитыванием
+# не реже раза в TTL; 0 — читать каждый раз
+DONE_CACHE_TTL_SECONDS = int(os.getenv("DONE_CACHE_TTL_SECONDS", "60").strip() or "60")
+
+# Таймаут одного HTTP-запроса к Sheets (сек)
+SHEETS_HTTP_TIMEOUT_SECONDS = int(os.getenv("SHEETS_HTTP_TIMEOUT_SECONDS", "20").strip() or "20")
+
+SHEETS_POOL_SIZE = int(os.getenv("SHEETS_POOL_SIZE", "8").strip() or "8")
+
+# Сколько апдейтов обрабатывается одновременно (в одном чате — всё равно по очереди)
+UPDATE_CONCURRENCY = int(os.getenv("UPDATE_CONCURRENCY", "32").strip() or "32")
+
 SCOPES = ["https://www.googleapis.com/auth/spreadsheets"]
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
@@ -111,7 +148,7 @@ log = logging.getLogger("wecafe-shift-bot")
 
 # -------------------- TIME HELPERS --------------------
 
-_tz = pytz.timezone(TIME_ZONE)
+_tz = ZoneInfo(TIME_ZONE)
 
 
 def now_tz() -> datetime:
@@ -130,11 +167,15 @@ def day_column_name() -> str:
 # -------------------- SANITIZE --------------------
 
 
+# с этих символов Sheets начинает формулу
+_FORMULA_PREFIXES = frozenset("=+-@")
+
+
 def sanitize_for_sheets(text: str) -> str:
     if not isinstance(text, str):
         text = str(text)
     text = text.strip()
-    if text and text[0] in ("=", "+", "-", "@"):
+    if text[:1] in _FORMULA_PREFIXES:
         return "'" + text
     return text
 
@@ -174,59 +215,317 @@ def format_control(title: str, user_name: str, user_id: int, point: str = "", de
     return "\n".join(lines)
 
 
-async def report_to_control(context: ContextTypes.DEFAULT_TYPE, text: str):
+def bullet_lines(items: Sequence[str], limit: int) -> List[str]:
+    """Список «• x» не длиннее limit строк; остаток — одной строкой «… и ещё N» (лимит 4096 символов у Telegram)."""
+    lines = [f"• {x}" for x in items[:limit]]
+    if len(items) > limit:
+        lines.append(f"… и ещё {len(items) - limit}")
+    return lines
+
+
+_control_breaker = {"failures": 0, "until": 0.0}
+
+
+def control_available() -> bool:
+    """Можно ли слать в контроль: отчёты включены, группа задана и предохранитель не сработал."""
     if not REPORT_TO_CONTROL or CONTROL_GROUP_ID == 0:
+        return False
+    return monotonic() >= _control_breaker["until"]
+
+
+def control_sent():
+    _control_breaker["failures"] = 0
+
+
+def control_failed(e: Exception):
+    """Учёт сбоя отправки в контроль.
+
+    429, оставшийся после повторов AIORateLimiter, — пауза ровно на retry_after. BadRequest (битый file_id,
+    длинный текст) — ошибка конкретного сообщения, группу не глушим. Остальное (сеть, бот удалён из группы) —
+    после CONTROL_BREAKER_FAILURES подряд пауза CONTROL_BREAKER_SECONDS.
+    """
+    if isinstance(e, RetryAfter):
+        ra = e.retry_after
+        ra = ra.total_seconds() if isinstance(ra, timedelta) else float(ra)
+        _control_breaker["until"] = max(_control_breaker["until"], monotonic() + ra)
+        log.warning("Контроль: флуд-лимит, пропускаю отправки %s сек", ra)
+        return
+    if isinstance(e, BadRequest):
+        return
+    _control_breaker["failures"] += 1
+    if _control_breaker["failures"] >= CONTROL_BREAKER_FAILURES:
+        _control_breaker["failures"] = 0
+        _control_breaker["until"] = monotonic() + CONTROL_BREAKER_SECONDS
+        log.warning("Контроль: %s сбоев подряд, пропускаю отправки %s сек", CONTROL_BREAKER_FAILURES, CONTROL_BREAKER_SECONDS)
+
+
+async def report_to_control(context: ContextTypes.DEFAULT_TYPE, text: str):
+    if not control_available():
         return
     try:
         await context.bot.send_message(chat_id=CONTROL_GROUP_ID, text=text)
+        control_sent()
     except Exception as e:
+        control_failed(e)
         log.warning("Не смог отправить сообщение в контроль: %s", e)
 
 
-async def report_photo_to_control(context: ContextTypes.DEFAULT_TYPE, file_id: str, caption: str = ""):
-    if not REPORT_TO_CONTROL or CONTROL_GROUP_ID == 0:
-        return
+async def report_photo_to_control(context: ContextTypes.DEFAULT_TYPE, file_id: str, caption: str = "") -> bool:
+    """Фото в контроль по file_id: Telegram пересылает уже загруженный файл, бот его не скачивает и не грузит заново.
+
+    Поэтому сюда (и в report_*photos_to_control) передаём только file_id из апдейта, а не байты/InputFile.
+    Возвращает, ушло ли фото.
+    """
+    if not control_available():
+        return False
     try:
         await context.bot.send_photo(chat_id=CONTROL_GROUP_ID, photo=file_id, caption=caption)
+        control_sent()
+        return True
     except Exception as e:
+        control_failed(e)
         log.warning("Не смог отправить фото в контроль: %s", e)
+        return False
+
+
+# sendMediaGroup принимает от 2 до 10 элементов
+MEDIA_GROUP_MAX = 10
+
+
+async def report_photos_to_control(context: ContextTypes.DEFAULT_TYPE, photos: List[Tuple[str, str]], text: str = ""):
+    """Несколько фото в контроль альбомами (один запрос на до 10 фото). photos: [(file_id, caption), ...].
+
+    Пустые file_id пропускаем. Если альбом не ушёл (например, один file_id битый) — шлём фото по одному.
+    text — отчёт, вклеенный в подпись первого фото (см. report_with_photos_to_control): если первый альбом
+    не ушёл, текст сначала уходит отдельным сообщением, а фото — со своими подписями.
+    """
+    if not control_available():
+        return
+    photos = [(fid, cap) for fid, cap in photos if fid]
+    for i in range(0, len(photos), MEDIA_GROUP_MAX):
+        chunk = photos[i:i + MEDIA_GROUP_MAX]
+        lead = text if i == 0 else ""
+        sent = chunk
+        if lead:
+            sent = [(chunk[0][0], f"{lead}\n\n{chunk[0][1]}")] + chunk[1:]
+        if len(chunk) == 1:
+            if not await report_photo_to_control(context, sent[0][0], caption=sent[0][1]) and lead:
+                await report_to_control(context, lead)
+            continue
+        try:
+            await context.bot.send_media_group(
+                chat_id=CONTROL_GROUP_ID,
+                media=[InputMediaPhoto(fid, caption=cap) for fid, cap in sent],
+            )
+            control_sent()
+        except Exception as e:
+            control_failed(e)
+            if lead:
+                await report_to_control(context, lead)
+            if not control_available():
+                log.warning("Не смог отправить альбом в контроль: %s", e)
+                return
+            log.warning("Не смог отправить альбом в контроль, шлю по одному: %s", e)
+            await asyncio.gather(*(report_photo_to_control(context, fid, caption=cap) for fid, cap in chunk))
+
+
+# лимит подписи к фото в Telegram
+CAPTION_MAX = 1024
+
+# file_id картинок, присланных файлом (документом): sendPhoto/sendMediaGroup их не примут, поэтому отчёт
+# к ним в подпись не вклеиваем. Только в памяти; переполнение — просто начинаем заново
+_image_document_ids: set[str] = set()
+IMAGE_DOCUMENT_IDS_MAX = 2048
+
+
+def remember_image_document(file_id: str):
+    if len(_image_document_ids) >= IMAGE_DOCUMENT_IDS_MAX:
+        _image_document_ids.clear()
+    _image_document_ids.add(file_id)
+
+
+async def report_with_photos_to_control(context: ContextTypes.DEFAULT_TYPE, text: str, photos: List[Tuple[str, str]]):
+    """Сообщение и фото к нему: если текст влезает в подпись первого фото — одна отправка вместо двух.
+
+    Иначе (длинный отчёт, нет фото, среди вложений есть картинка-документ) — как раньше: сообщение, затем фото.
+    Если альбом с подписью не ушёл, текст всё равно отправляется отдельным сообщением.
+    """
+    photos = [(fid, cap) for fid, cap in photos if fid]
+    if (
+        photos
+        and len(text) + 2 + len(photos[0][1]) <= CAPTION_MAX
+        and not any(fid in _image_document_ids for fid, _ in photos)
+    ):
+        await report_photos_to_control(context, photos, text=text)
+        return
+    await report_to_control(context, text)
+    await report_photos_to_control(context, photos)
+
+
+def report_in_background(context: ContextTypes.DEFAULT_TYPE, *reports):
+    """Отчёты в контроль не должны задерживать ответ сотруднику: выполняем их фоном, по порядку.
+
+    reports — корутины report_to_control / report_*photos_to_control (ошибки они логируют сами).
+    """
+    async def _run():
+        for r in reports:
+            await r
+
+    context.application.create_task(_run())
 
 
 # -------------------- GOOGLE SHEETS --------------------
 
 _svc = None
+_svc_lock = threading.RLock()
+
+
+_creds = None
+_tls = threading.local()
 
 
 def _load_creds():
     if GOOGLE_SHEETS_CREDENTIALS_JSON_B64:
         raw = base64.b64decode(GOOGLE_SHEETS_CREDENTIALS_JSON_B64.encode("utf-8")).decode("utf-8")
-        info = json.loads(raw)
+        info = orjson.loads(raw)
         return service_account.Credentials.from_service_account_info(info, scopes=SCOPES)
     return service_account.Credentials.from_service_account_file(GOOGLE_SHEETS_CREDENTIALS_FILE, scopes=SCOPES)
 
 
+class OrjsonModel(JsonModel):
+    """JsonModel с разбором ответов Sheets на orjson (все чтения users/sessions/логов).
+
+    Тела запросов собирает штатный json.dumps: он экранирует не-ASCII, а httplib2/http.client кодирует
+    str-тело в Latin-1 — кириллица из orjson (имена, точки, задачи) падала бы с UnicodeEncodeError.
+    """
+
+    def deserialize(self, content):
+        try:
+            body = orjson.loads(content)
+        except orjson.JSONDecodeError:
+            return content.decode("utf-8") if isinstance(content, bytes) else content
+        if self._data_wrapper and isinstance(body, dict) and "data" in body:
+            body = body["data"]
+        return body
+
+
+def _get_creds():
+    global _creds
+    if _creds is None:
+        with _svc_lock:
+            if _creds is None:
+                _creds = _load_creds()
+    return _creds
+
+
 def sheets_service():
     global _svc
     if _svc is None:
-        _svc = build("sheets", "v4", credentials=_load_creds(), cache_discovery=False)
+        # первые обращения из потоков SHEETS_POOL могут прийти одновременно — строим сервис один раз
+        with _svc_lock:
+            if _svc is None:
+                # discovery-документ Sheets v4 берём из пакета google-api-python-client, без HTTP-запроса на старте
+                _svc = build(
+                    "sheets", "v4",
+                    credentials=_get_creds(),
+                    cache_discovery=False,
+                    static_discovery=True,
+                    model=OrjsonModel(),
+                )
     return _svc
 
 
+def sheets_http() -> AuthorizedHttp:
+    """httplib2 не потокобезопасен: вызовы из SHEETS_POOL идут через свой Http на поток.
+
+    Http держит соединение с sheets.googleapis.com открытым (keep-alive), поэтому TLS-рукопожатие —
+    одно на поток, а не на запрос; таймаут не даёт зависшему запросу навсегда занять поток.
+    """
+    h = getattr(_tls, "http", None)
+    if h is None:
+        h = AuthorizedHttp(_get_creds(), http=httplib2.Http(timeout=SHEETS_HTTP_TIMEOUT_SECONDS))
+        _tls.http = h
+    return h
+
+
+# Все синхронные вызовы Sheets из обработчиков и джобов идут через этот пул, а не в event loop.
+# У каждого потока своё keep-alive соединение (sheets_http); размер пула — сколько запросов к таблице
+# выполняются одновременно, остальные ждут в очереди, не плодя новых потоков и TLS-соединений.
+SHEETS_POOL = ThreadPoolExecutor(max_workers=SHEETS_POOL_SIZE, thread_name_prefix="sheets")
+
+
+async def run_sheets(fn, *args, **kwargs):
+    """await-обёртка: fn(*args, **kwargs) в SHEETS_POOL."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(SHEETS_POOL, partial(fn, *args, **kwargs))
+
+
 def sheet_get(range_a1: str) -> List[List[str]]:
     service = sheets_service()
-    res = service.spreadsheets().values().get(spreadsheetId=SPREADSHEET_ID, range=range_a1).execute()
+    res = service.spreadsheets().values().get(spreadsheetId=SPREADSHEET_ID, range=range_a1).execute(http=sheets_http())
     return res.get("values", [])
 
 
-def sheet_append(sheet_name: str, row: List[str]):
+# Снимки листов в памяти: dict {"rows", "at", ...производные от rows}. Свои записи бот отражает в снимке
+# сам (или сбрасывает его), TTL — чтобы подтянуть правки, сделанные руками в таблице.
+_cache_locks: Dict[int, threading.Lock] = {}
+
+
+def cache_stale(cache: Dict[str, Any], ttl: float) -> bool:
+    return cache["rows"] is None or monotonic() - cache["at"] > ttl
+
+
+def cached_sheet_get(cache: Dict[str, Any], range_a1: str, ttl: float, **reset: Any) -> List[List[str]]:
+    """Снимок range_a1 из cache, перечитываемый по TTL; reset — производные поля, которые сбрасываются вместе с ним.
+
+    Когда снимок истёк, а запросов пришло несколько сразу, лист читает только первый поток — остальные ждут его.
+    """
+    if cache_stale(cache, ttl):
+        with _cache_locks.setdefault(id(cache), threading.Lock()):
+            if cache_stale(cache, ttl):
+                cache.update(reset, rows=sheet_get(range_a1), at=monotonic())
+    return cache["rows"]
+
+
+def sheet_batch_get(ranges: List[str]) -> List[List[List[str]]]:
+    """Несколько диапазонов за один запрос; результат — в порядке ranges."""
+    service = sheets_service()
+    res = service.spreadsheets().values().batchGet(
+        spreadsheetId=SPREADSHEET_ID,
+        ranges=ranges,
+        fields="valueRanges(values)",
+    ).execute(http=sheets_http())
+    value_ranges = res.get("valueRanges", [])
+    return [vr.get("values", []) for vr in value_ranges] + [[] for _ in range(len(ranges) - len(value_ranges))]
+
+
+_UPDATED_ROW_RE = re.compile(r"![A-Z]+(\d+)")
+
+
+# Логи (done_log, close_log) только дописываются: строки пишем в пустые строки под таблицей,
+# а не вставляем новые — Sheets не сдвигает лист и не пересчитывает ссылки на него.
+# Если сетка закончилась, append всё равно её расширит.
+APPEND_OVERWRITE_SHEETS = frozenset((SHEET_DONE, SHEET_CLOSE))
+
+
+def sheet_append(sheet_name: str, row: List[str]) -> Optional[int]:
+    """Добавляет строку; возвращает её номер в листе (из updates.updatedRange), если его удалось разобрать."""
+    return sheet_append_rows(sheet_name, [row])
+
+
+def sheet_append_rows(sheet_name: str, rows: List[List[str]]) -> Optional[int]:
+    """Несколько строк одним запросом; возвращает номер первой из них."""
     service = sheets_service()
-    service.spreadsheets().values().append(
+    res = service.spreadsheets().values().append(
         spreadsheetId=SPREADSHEET_ID,
         range=sheet_name,
         valueInputOption="RAW",
-        insertDataOption="INSERT_ROWS",
-        body={"values": [row]},
-    ).execute()
+        insertDataOption="OVERWRITE" if sheet_name in APPEND_OVERWRITE_SHEETS else "INSERT_ROWS",
+        body={"values": rows},
+        fields="updates(updatedRange)",  # из ответа нужен только номер добавленной строки
+    ).execute(http=sheets_http())
+    m = _UPDATED_ROW_RE.search((res or {}).get("updates", {}).get("updatedRange", ""))
+    return int(m.group(1)) if m else None
 
 
 def sheet_update(range_a1: str, row: List[str]):
@@ -236,38 +535,169 @@ def sheet_update(range_a1: str, row: List[str]):
         range=range_a1,
         valueInputOption="RAW",
         body={"values": [row]},
-    ).execute()
+        fields="updatedRange",
+    ).execute(http=sheets_http())
+
+
+# Строки логов (done_log, close_log) копятся здесь по листам и уходят одним append на лист:
+# серия отметок за APPEND_FLUSH_DELAY_SECONDS — один запрос вместо одного на строку.
+APPEND_FLUSH_DELAY_SECONDS = 0.1
+# строки, которые не удалось записать (сбой Sheets), повторяем фоновым джобом с таким интервалом
+APPEND_RETRY_SECONDS = 30
+
+_append_pending: Dict[str, List[List[str]]] = {}
+_append_pending_lock = threading.Lock()
+# один flush за раз: иначе параллельные flush запишут одни и те же строки дважды
+_append_flush_lock = threading.Lock()
+_append_flush_state: Dict[str, bool] = {"scheduled": False}
+
+
+def enqueue_append(sheet_name: str, row: List[str]):
+    with _append_pending_lock:
+        _append_pending.setdefault(sheet_name, []).append(row)
+
+
+def pending_appends(sheet_name: str) -> List[List[str]]:
+    """Ещё не записанные строки листа — читатели добавляют их к снимку, чтобы видеть свои записи сразу."""
+    with _append_pending_lock:
+        return list(_append_pending.get(sheet_name, ()))
+
+
+def has_pending_appends() -> bool:
+    with _append_pending_lock:
+        return any(_append_pending.values())
+
+
+def flush_appends():
+    """Пишет накопленные строки. При ошибке строки листа остаются в очереди до следующего flush."""
+    with _append_flush_lock:
+        with _append_pending_lock:
+            batch = {name: list(rows) for name, rows in _append_pending.items() if rows}
+        first_error: Optional[Exception] = None
+        written: List[str] = []
+        if len(batch) > 1:
+            # очередь есть в нескольких листах (например, done_log и close_log при закрытии смены) — один RPC
+            try:
+                sheet_append_cells(batch)
+                written = list(batch)
+                if SHEET_DONE in batch:
+                    # appendCells не сообщает, куда легли строки — ручное удаление строк не заметить
+                    note_done_append(None)
+            except Exception as e:
+                # запрос атомарный — ничего не записано; id листов могли устареть (лист пересоздали руками)
+                log.warning("Не смог записать логи одним запросом, пишу по листам: %s", e)
+                _sheet_ids.clear()
+        if not written:
+            for sheet_name, rows in batch.items():
+                try:
+                    first_row = sheet_append_rows(sheet_name, rows)
+                    written.append(sheet_name)
+                    if sheet_name == SHEET_DONE:
+                        note_done_append(first_row)
+                except Exception as e:
+                    first_error = first_error or e
+        for sheet_name in written:
+            with _append_pending_lock:
+                # новые строки за время запроса дописывались в конец — снимаем только записанные
+                del _append_pending[sheet_name][:len(batch[sheet_name])]
+            if sheet_name == SHEET_DONE:
+                invalidate_done_cache()
+        if first_error is not None:
+            raise first_error
+
+
+def request_append_flush(context: ContextTypes.DEFAULT_TYPE):
+    """Отложенный flush: всё, что встанет в очередь за APPEND_FLUSH_DELAY_SECONDS, уйдёт вместе."""
+    if _append_flush_state["scheduled"]:
+        return
+    _append_flush_state["scheduled"] = True
+
+    async def _run():
+        await asyncio.sleep(APPEND_FLUSH_DELAY_SECONDS)
+        _append_flush_state["scheduled"] = False
+        try:
+            await run_sheets(flush_appends)
+        except Exception as e:
+            log.warning("Не смог записать строки логов, повторю позже: %s", e)
+
+    context.application.create_task(_run())
+
+
+# title -> sheetId; id листа постоянен, поэтому метаданные читаем один раз (нужны для appendCells)
+_sheet_ids: Dict[str, int] = {}
+
+
+async def append_retry_job(context: ContextTypes.DEFAULT_TYPE):
+    """Повтор записи очереди логов, если отложенный flush не прошёл (не зависит от напоминаний)."""
+    if not has_pending_appends():
+        return
+    try:
+        await run_sheets(flush_appends)
+    except Exception as e:
+        log.warning("Не смог записать строки логов, повторю позже: %s", e)
 
 
 def get_sheet_titles() -> List[str]:
     service = sheets_service()
     meta = service.spreadsheets().get(
         spreadsheetId=SPREADSHEET_ID,
-        fields="sheets(properties(title))",
-    ).execute()
-    return [s["properties"]["title"] for s in meta.get("sheets", [])]
+        fields="sheets(properties(title,sheetId))",
+    ).execute(http=sheets_http())
+    ids = {s["properties"]["title"]: s["properties"]["sheetId"] for s in meta.get("sheets", [])}
+    _sheet_ids.update(ids)
+    return list(ids)
+
+
+def get_sheet_ids() -> Dict[str, int]:
+    if not _sheet_ids:
+        get_sheet_titles()
+    return _sheet_ids
 
 
-def ensure_sheet_exists(sheet_title: str):
-    titles = set(get_sheet_titles())
-    if sheet_title in titles:
+def spreadsheet_batch_update(requests: List[Dict[str, Any]]):
+    """Структурные правки и запись ячеек одним атомарным spreadsheets.batchUpdate."""
+    if not requests:
         return
     service = sheets_service()
     service.spreadsheets().batchUpdate(
         spreadsheetId=SPREADSHEET_ID,
-        body={"requests": [{"addSheet": {"properties": {"title": sheet_title}}}]},
-    ).execute()
+        body={"requests": requests},
+        fields="spreadsheetId",
+    ).execute(http=sheets_http())
 
 
-def ensure_header(sheet_title: str, header: List[str]):
-    values = sheet_get(sheet_title)
-    if not values:
-        sheet_append(sheet_title, header)
+def _cell_rows(rows: List[List[str]]) -> List[Dict[str, Any]]:
+    # значения пишутся как текст — так же, как values.append/update с RAW
+    return [
+        {"values": [{"userEnteredValue": {"stringValue": "" if v is None else str(v)}} for v in row]}
+        for row in rows
+    ]
+
+
+def sheet_append_cells(batch: Dict[str, List[List[str]]]):
+    """Строки в несколько листов одним spreadsheets.batchUpdate (appendCells на лист).
+
+    Запрос атомарный: либо записаны все листы, либо ни один.
+    """
+    ids = get_sheet_ids()
+    spreadsheet_batch_update([
+        {"appendCells": {"sheetId": ids[sheet_name], "rows": _cell_rows(rows), "fields": "userEnteredValue"}}
+        for sheet_name, rows in batch.items()
+    ])
 
 
 def is_header(row: List[str], must_include: str) -> bool:
-    low = [c.strip().lower() for c in row]
-    return must_include.lower() in low
+    need = must_include.lower()
+    return any(c.strip().lower() == need for c in row)
+
+
+def _cached_header_flag(cache: Dict[str, Any], rows: List[List[str]], must_include: str) -> bool:
+    """is_header для первой строки закэшированного снимка: пересчитываем, только когда сменилась сама строка."""
+    memo = cache.get("header")
+    if memo is None or memo[0] is not rows[0]:
+        memo = (rows[0], is_header(rows[0], must_include))
+        cache["header"] = memo
+    return memo[1]
 
 
 # -------------------- SCHEMAS --------------------
@@ -303,38 +733,74 @@ CLOSE_HEADER = [
 
 
 def ensure_sheets():
-    ensure_sheet_exists(SHEET_USERS)
-    ensure_sheet_exists(SHEET_POINTS)
-    ensure_sheet_exists(SHEET_SCHEDULE)
-    ensure_sheet_exists(SHEET_DONE)
-    ensure_sheet_exists(SHEET_SESSIONS)
-    ensure_sheet_exists(SHEET_CLOSE)
-
-    ensure_header(SHEET_USERS, USERS_HEADER)
-    ensure_header(SHEET_DONE, DONE_HEADER)
-    ensure_header(SHEET_SESSIONS, SESSIONS_HEADER)
-    ensure_header(SHEET_CLOSE, CLOSE_HEADER)
+    """Листы и заголовки при старте: список листов, чтение колонки A существующих листов и один batchUpdate,
+    который и создаёт недостающие листы, и пишет им заголовки. Заголовок пишется только в совсем пустой лист."""
+    get_sheet_titles()  # заодно запоминает id листов в _sheet_ids
+    ids = dict(_sheet_ids)
+    missing = [t for t in (SHEET_USERS, SHEET_POINTS, SHEET_SCHEDULE, SHEET_DONE, SHEET_SESSIONS, SHEET_CLOSE) if t not in ids]
+
+    headers = {
+        SHEET_USERS: USERS_HEADER,
+        SHEET_DONE: DONE_HEADER,
+        SHEET_SESSIONS: SESSIONS_HEADER,
+        SHEET_CLOSE: CLOSE_HEADER,
+    }
+    # только что созданные листы заведомо пустые; у остальных пустой может быть и одна первая строка
+    # (данные ниже), поэтому смотрим всю колонку A — она заполнена в каждой строке данных
+    to_check = [t for t in headers if t not in missing]
+    columns = sheet_batch_get([f"{t}!A:A" for t in to_check]) if to_check else []
+    empty_existing = [t for t, col in zip(to_check, columns) if not any(r and r[0] for r in col)]
+
+    # id новым листам назначаем сами, чтобы в том же запросе сослаться на них в updateCells
+    next_id = max(ids.values(), default=0) + 1
+    requests: List[Dict[str, Any]] = []
+    for t in missing:
+        ids[t] = next_id
+        next_id += 1
+        requests.append({"addSheet": {"properties": {"title": t, "sheetId": ids[t]}}})
+        if t in headers:
+            # сетка нового листа стандартная (26 колонок) — заголовок в неё помещается
+            requests.append({
+                "updateCells": {
+                    "start": {"sheetId": ids[t], "rowIndex": 0, "columnIndex": 0},
+                    "rows": _cell_rows([headers[t]]),
+                    "fields": "userEnteredValue",
+                }
+            })
+    spreadsheet_batch_update(requests)
+    _sheet_ids.update(ids)
+    # существующий пустой лист мог быть обрезан вручную — append, как раньше, сам расширит сетку
+    for t in empty_existing:
+        sheet_append_rows(t, [headers[t]])
 
 
 # -------------------- POINTS --------------------
 
 
-DEFAULT_POINTS = ["69 Параллель", "Арена", "Музей", "Сочнева"]
+DEFAULT_POINTS = ("69 Параллель", "Арена", "Музей", "Сочнева")
+
 
+# points — (снимок rows, разобранный кортеж точек): один общий объект на всех пользователей до обновления листа
+_points_cache: Dict[str, Any] = {"rows": None, "at": 0.0, "points": None}
 
-def load_points() -> List[str]:
-    rows = sheet_get(SHEET_POINTS)
+
+def load_points() -> Tuple[str, ...]:
+    """Список точек (только чтение): тот же кортеж, пока не обновится снимок листа."""
+    rows = cached_sheet_get(_points_cache, f"{SHEET_POINTS}!A:A", POINTS_CACHE_TTL_SECONDS)  # нужна только колонка point
     if not rows:
         return DEFAULT_POINTS
+    memo = _points_cache["points"]
+    if memo and memo[0] is rows:
+        return memo[1]
     start = 1 if is_header(rows[0], "point") else 0
-    pts: List[str] = []
-    for r in rows[start:]:
-        if r and r[0].strip():
-            pts.append(r[0].strip())
-    return pts or DEFAULT_POINTS
+    pts = tuple(r[0].strip() for r in rows[start:] if r and r[0].strip()) or DEFAULT_POINTS
+    _points_cache["points"] = (rows, pts)
+    return pts
 
 
+@lru_cache(maxsize=256)
 def normalize_point(point: str) -> str:
+    # вызывается в каждом цикле по строкам логов, а различных значений — единицы
     p = (point or "").strip()
     # мягкая нормализация под варианты из старой таблицы
     if "музей" in p.lower():
@@ -366,23 +832,74 @@ STATUS_ACTIVE = "Активен"
 STATUS_BLOCKED = "Заблокирован"
 
 
+# index — (снимок rows, {user_id: номер строки}) для поиска пользователя без прохода по листу
+_users_cache: Dict[str, Any] = {"rows": None, "at": 0.0, "index": None}
+# read-modify-write строки пользователя атомарно (обработчики работают в потоках)
+_users_write_lock = threading.RLock()
+
+
+def invalidate_users_cache():
+    _users_cache["rows"] = None
+
+
+def _users_cache_put(idx: Optional[int], row: List[str]):
+    """Записали строку idx сами — подменяем её в снимке вместо полного перечитывания листа.
+
+    Снимок не мутируем (его могут читать другие потоки), а подменяем копией; "at" не трогаем,
+    чтобы ручные правки в таблице всё равно подтянулись по TTL.
+    """
+    rows = _users_cache["rows"]
+    if rows is None:
+        return
+    if idx is None or idx < 1 or idx > len(rows) + 1:
+        invalidate_users_cache()
+        return
+    new_rows = list(rows)
+    if idx == len(rows) + 1:
+        new_rows.append(row)
+    else:
+        new_rows[idx - 1] = row
+    memo = _users_cache["index"]
+    new_index = None
+    if memo and memo[0] is rows and idx > 1:
+        new_index = dict(memo[1])
+        new_index.setdefault(row[0], idx)
+    _users_cache["rows"] = new_rows
+    _users_cache["index"] = (new_rows, new_index) if new_index is not None else None
+
+
 def _users_rows() -> Tuple[List[List[str]], bool]:
-    rows = sheet_get(SHEET_USERS)
+    # строки из кэша не изменяем — они общие для всех обработчиков
+    rows = cached_sheet_get(_users_cache, SHEET_USERS, USERS_CACHE_TTL_SECONDS)
     if not rows:
         return [], False
-    has_header = is_header(rows[0], "user_id")
+    has_header = _cached_header_flag(_users_cache, rows, "user_id")
     return rows, has_header
 
 
+def _users_index(rows: List[List[str]], has_header: bool) -> Dict[str, int]:
+    memo = _users_cache["index"]
+    if memo and memo[0] is rows:
+        return memo[1]
+    index: Dict[str, int] = {}
+    start = 1 if has_header else 0
+    for i, row in enumerate(rows[start:], start=1 + start):
+        if row:
+            # при дублях побеждает первая строка — как при линейном поиске
+            index.setdefault(row[0], i)
+    if rows is _users_cache["rows"]:
+        _users_cache["index"] = (rows, index)
+    return index
+
+
 def get_user_row_and_index(user_id: int) -> Tuple[Optional[List[str]], Optional[int], bool]:
     rows, has_header = _users_rows()
     if not rows:
         return None, None, has_header
-    start = 1 if has_header else 0
-    for i, row in enumerate(rows[start:], start=1 + start):
-        if len(row) >= 1 and row[0] == str(user_id):
-            return row, i, has_header
-    return None, None, has_header
+    i = _users_index(rows, has_header).get(str(user_id))
+    if i is None:
+        return None, None, has_header
+    return rows[i - 1], i, has_header
 
 
 def parse_user(row: List[str]) -> UserRec:
@@ -406,33 +923,48 @@ def get_user(user_id: int) -> Optional[UserRec]:
         return None
 
 
+def get_user_with_snapshot(user_id: int) -> Tuple[Optional[List[List[str]]], Optional[UserRec]]:
+    """get_user и снимок users, из которого прочитана запись (None — снимок сменился во время чтения)."""
+    rows, _ = _users_rows()
+    u = get_user(user_id)
+    return (rows if rows and _users_cache["rows"] is rows else None), u
+
+
 def upsert_user(user_id: int, name: str, point: str = "", status: str = STATUS_PENDING):
     name = normalize_name(name)
     point = sanitize_for_sheets(normalize_point(point))
     ts = now_tz().isoformat(timespec="seconds")
 
-    row, idx, _ = get_user_row_and_index(user_id)
-    if row is None:
-        sheet_append(SHEET_USERS, [str(user_id), name, point, status, ts, ts])
-        return
-
-    created_at = row[4] if len(row) >= 5 else ts
-    new_row = [str(user_id), name, point, status, created_at, ts]
-    sheet_update(f"{SHEET_USERS}!A{idx}:F{idx}", new_row)
+    with _users_write_lock:
+        row, idx, _ = get_user_row_and_index(user_id)
+        try:
+            if row is None:
+                new_row = [str(user_id), name, point, status, ts, ts]
+                idx = sheet_append(SHEET_USERS, new_row)
+            else:
+                created_at = row[4] if len(row) >= 5 else ts
+                new_row = [str(user_id), name, point, status, created_at, ts]
+                sheet_update(f"{SHEET_USERS}!A{idx}:F{idx}", new_row)
+        except Exception:
+            invalidate_users_cache()
+            raise
+        _users_cache_put(idx, new_row)
 
 
 def set_user_status(user_id: int, status: str):
-    u = get_user(user_id)
-    if not u:
-        return
-    upsert_user(user_id, u.name, u.point, status=status)
+    with _users_write_lock:
+        u = get_user(user_id)
+        if not u:
+            return
+        upsert_user(user_id, u.name, u.point, status=status)
 
 
 def set_user_point(user_id: int, point: str):
-    u = get_user(user_id)
-    if not u:
-        return
-    upsert_user(user_id, u.name, point, status=u.status)
+    with _users_write_lock:
+        u = get_user(user_id)
+        if not u:
+            return
+        upsert_user(user_id, u.name, point, status=u.status)
 
 
 def is_user_active(user_id: int) -> bool:
@@ -450,10 +982,12 @@ def is_user_pending(user_id: int) -> bool:
     return bool(u and u.status == STATUS_PENDING)
 
 
-def list_active_users_by_point(point: str) -> List[UserRec]:
+def _active_users() -> List[UserRec]:
+    """Разобранные активные сотрудники для текущего снимка users (пересобираются только при его смене)."""
     rows, has_header = _users_rows()
-    if not rows:
-        return []
+    memo = _users_cache.get("active")
+    if memo and memo[0] is rows:
+        return memo[1]
     start = 1 if has_header else 0
     out: List[UserRec] = []
     for r in rows[start:]:
@@ -463,31 +997,21 @@ def list_active_users_by_point(point: str) -> List[UserRec]:
             u = parse_user(r)
         except Exception:
             continue
-        if u.status != STATUS_ACTIVE:
-            continue
-        if normalize_point(u.point) != normalize_point(point):
-            continue
-        out.append(u)
+        if u.status == STATUS_ACTIVE:
+            out.append(u)
+    if rows is _users_cache["rows"]:
+        _users_cache["active"] = (rows, out)
     return out
 
 
+def list_active_users_by_point(point: str) -> List[UserRec]:
+    p = normalize_point(point)
+    return [u for u in _active_users() if normalize_point(u.point) == p]
+
+
 def list_active_users_all() -> List[UserRec]:
     """Все активные сотрудники (независимо от выбранной точки)."""
-    rows, has_header = _users_rows()
-    if not rows:
-        return []
-    start = 1 if has_header else 0
-    out: List[UserRec] = []
-    for r in rows[start:]:
-        if len(r) < 4:
-            continue
-        try:
-            u = parse_user(r)
-        except Exception:
-            continue
-        if u.status == STATUS_ACTIVE:
-            out.append(u)
-    return out
+    return list(_active_users())
 
 
 # -------------------- TASKS / SCHEDULE --------------------
@@ -500,43 +1024,96 @@ class Task:
     point: str
 
 
+_TRUTHY = frozenset(("1", "true", "yes", "да", "y", "ok"))
+
+
 def _truthy(x: str) -> bool:
-    s = (x or "").strip().lower()
-    return s in ("1", "true", "yes", "да", "y", "ok")
+    # обычные значения в графике — "1"/"TRUE" или пусто: без strip/lower
+    if x == "1" or x == "TRUE":
+        return True
+    if not x:
+        return False
+    return x.strip().lower() in _TRUTHY
+
+
+# rows — снимок листа; tasks — разобранные задачи по (день, точка) для этого снимка;
+# today — (день, отмеченные на сегодня строки) — общая часть разбора для всех точек
+_schedule_cache: Dict[str, Any] = {"rows": None, "at": 0.0, "tasks": {}, "today": None}
 
 
-def load_tasks_for_today(point_selected: str) -> List[Task]:
+def load_schedule_rows() -> List[List[str]]:
+    return cached_sheet_get(_schedule_cache, SHEET_SCHEDULE, SCHEDULE_CACHE_TTL_SECONDS, tasks={}, today=None)
+
+
+def load_tasks_for_today(point_selected: str, rows: Optional[List[List[str]]] = None) -> List[Task]:
     """
     Берём из cleaning_schedule задачи, у которых:
     - в колонке D{сегодня} стоит 1/TRUE
     - point == выбранная точка ИЛИ point == ALL
+
+    rows — уже прочитанный лист (load_schedule_rows), чтобы не читать его на каждую точку.
+    Для закэшированного снимка результат запоминается по (день, точка).
     """
-    rows = sheet_get(SHEET_SCHEDULE)
-    if not rows:
-        return []
-    header = rows[0]
-    col = day_column_name()
-    try:
-        day_idx = header.index(col)
-    except ValueError:
-        return []
-    tasks: List[Task] = []
-    for r in rows[1:]:
-        if len(r) <= max(2, day_idx):
-            continue
-        task_id = (r[0] or "").strip() if len(r) > 0 else ""
-        task_name = (r[1] or "").strip() if len(r) > 1 else ""
-        p = (r[2] or "").strip() if len(r) > 2 else ""
-        flag = r[day_idx] if len(r) > day_idx else "0"
-        if not task_id or not task_name:
-            continue
-        if not _truthy(flag):
-            continue
-        if p == "ALL" or normalize_point(p) == normalize_point(point_selected):
-            tasks.append(Task(task_id=task_id, task_name=task_name, point=p))
+    return list(tasks_for_today_shared(point_selected, rows))
+
+
+def tasks_for_today_shared(point_selected: str, rows: Optional[List[List[str]]] = None) -> Tuple[Task, ...]:
+    """То же, что load_tasks_for_today, но без копии: общий кортеж из кэша — только для чтения
+    (напоминания проходят по нему для каждой смены каждый тик)."""
+    if rows is None:
+        rows = load_schedule_rows()
+    if rows is not _schedule_cache["rows"]:
+        return tuple(_parse_tasks_for_today(rows, point_selected))
+    key = (day_key(), normalize_point(point_selected))
+    tasks = _schedule_cache["tasks"].get(key)
+    if tasks is None:
+        tasks = tuple(_parse_tasks_for_today(rows, point_selected))
+        _schedule_cache["tasks"][key] = tasks
     return tasks
 
 
+def _scheduled_today(rows: List[List[str]]) -> List[Tuple[str, str, str, str]]:
+    """(task_id, task_name, point, нормализованная point) для строк с флагом на сегодня.
+
+    Колонка дня и флаги одинаковы для всех точек — для закэшированного снимка считаем их раз в день.
+    """
+    d = day_key()
+    memo = _schedule_cache["today"]
+    cached = rows is _schedule_cache["rows"]
+    if cached and memo and memo[0] == d:
+        return memo[1]
+    out: List[Tuple[str, str, str, str]] = []
+    if rows:
+        try:
+            day_idx = rows[0].index(day_column_name())
+        except ValueError:
+            day_idx = -1
+        if day_idx >= 0:
+            min_len = max(2, day_idx) + 1
+            for r in rows[1:]:
+                # короткие строки (без флага на сегодня) и пустые флаги отсекаем до разбора остальных ячеек
+                if len(r) < min_len or not _truthy(r[day_idx]):
+                    continue
+                task_id = (r[0] or "").strip()
+                task_name = (r[1] or "").strip()
+                if not task_id or not task_name:
+                    continue
+                p = (r[2] or "").strip()
+                out.append((task_id, task_name, p, normalize_point(p)))
+    if cached:
+        _schedule_cache["today"] = (d, out)
+    return out
+
+
+def _parse_tasks_for_today(rows: List[List[str]], point_selected: str) -> List[Task]:
+    target = normalize_point(point_selected)
+    return [
+        Task(task_id=task_id, task_name=task_name, point=p)
+        for task_id, task_name, p, norm in _scheduled_today(rows)
+        if p == "ALL" or norm == target
+    ]
+
+
 def split_tasks_half(tasks: List[Task]) -> Tuple[List[Task], List[Task], int]:
     """Делим пополам стабильно по порядку. Возвращаем (part1, part2, split_index)."""
     n = len(tasks)
@@ -548,70 +1125,207 @@ def split_tasks_half(tasks: List[Task]) -> Tuple[List[Task], List[Task], int]:
 
 
 def log_done(day: str, point: str, user: UserRec, task: Task, part: str, photo1: str, photo2: str):
+    """Ставит отметку в очередь на запись (request_append_flush); в load_done_rows она видна сразу."""
     ts = now_tz().isoformat(timespec="seconds")
-    sheet_append(
-        SHEET_DONE,
-        [
-            ts,
-            day,
-            sanitize_for_sheets(normalize_point(point)),
-            str(user.user_id),
-            sanitize_for_sheets(user.name),
-            sanitize_for_sheets(task.task_id),
-            sanitize_for_sheets(task.task_name),
-            sanitize_for_sheets(part),
-            photo1,
-            photo2,
-        ],
-    )
+    row = [
+        ts,
+        day,
+        sanitize_for_sheets(normalize_point(point)),
+        str(user.user_id),
+        sanitize_for_sheets(user.name),
+        sanitize_for_sheets(task.task_id),
+        sanitize_for_sheets(task.task_name),
+        sanitize_for_sheets(part),
+        photo1,
+        photo2,
+    ]
+    enqueue_append(SHEET_DONE, row)
 
 
-def get_done_task_ids(day: str, point: str) -> set[str]:
-    """Глобально на точке/день: какие task_id уже закрыты (независимо от сотрудника)."""
-    try:
-        rows = sheet_get(f"{SHEET_DONE}!A2:J")
-    except Exception:
-        return set()
-    out: set[str] = set()
-    p = normalize_point(point)
+def done_read_range(first_row: int) -> str:
+    # timestamp..task_id: колонки с file_id фото (самые длинные строки лога) для проверок не нужны
+    return f"{SHEET_DONE}!A{first_row}:F"
+
+
+# колонка day — по ней на холодном старте ищем, с какой строки начинаются сегодня/вчера
+DONE_DAY_RANGE = f"{SHEET_DONE}!B2:B"
+
+
+# Бот done_log только дописывает: держим в памяти строки за сегодня и вчера (смена может закрываться
+# после полуночи) и после своих записей дочитываем лист с next_row, а не целиком. Холодное чтение берёт
+# A..F только со строки, где начинается вчерашний день (история за месяцы — одной узкой колонкой); при
+# смене дня прошедшие строки отбрасываются в памяти. Лист правят и руками (удаляют строки), поэтому
+# не реже раза в DONE_CACHE_TTL_SECONDS (cold_at) и при сдвиге строк перечитываем холодно.
+_done_cache: Dict[str, Any] = {"rows": None, "at": 0.0, "cold_at": 0.0, "next_row": 2, "since": ""}
+# дочитывание из двух потоков сразу продублировало бы строки в снимке
+_done_read_lock = threading.Lock()
+
+
+def invalidate_done_cache():
+    # только «устарел»: следующее чтение дочитает новые строки, а не весь лог
+    _done_cache["at"] = 0.0
+
+
+def note_done_append(first_row: Optional[int]):
+    """Свои строки легли выше next_row — строки из листа удалили руками: номера в снимке сдвинулись, дочитывание
+    с next_row пропустило бы новые отметки. Сбрасываем снимок, следующее чтение будет холодным.
+
+    first_row=None — номер строки неизвестен (запись через appendCells, неразобранный ответ): проверить
+    сдвиг нечем, поэтому снимок тоже сбрасываем.
+    """
+    with _done_read_lock:
+        if _done_cache["rows"] is None:
+            return
+        if first_row is None:
+            _done_cache["rows"] = None
+        elif first_row < _done_cache["next_row"]:
+            log.info("done_log: строки удалены вручную (запись в %s, ждали %s), перечитываю", first_row, _done_cache["next_row"])
+            _done_cache["rows"] = None
+
+
+def _done_tail_ok(now: float) -> bool:
+    """Снимок можно дочитать с next_row (а не перечитать целиком): полное чтение было не дольше TTL назад."""
+    return _done_cache["rows"] is not None and now - _done_cache["cold_at"] <= DONE_CACHE_TTL_SECONDS
+
+
+def _done_since() -> str:
+    return (now_tz().date() - timedelta(days=1)).isoformat()
+
+
+def _done_cache_store(fresh: List[List[str]], start_row: int, since: str, base: Optional[List[List[str]]] = None):
+    kept = [r for r in fresh if len(r) > 1 and r[1] >= since]
+    _done_cache["rows"] = (base + kept) if base else kept
+    _done_cache["next_row"] = start_row + len(fresh)
+    _done_cache["since"] = since
+    _done_cache["at"] = monotonic()
+
+
+def _done_read_recent(since: str) -> Tuple[List[List[str]], int]:
+    """Холодное чтение: (строки A..F начиная с первой строки с day >= since, номер этой строки)."""
+    started = monotonic()
+    days = sheet_get(DONE_DAY_RANGE)
+    skip = next((i for i, r in enumerate(days) if r and r[0] >= since), len(days))
+    first_row = 2 + skip
+    fresh = sheet_get(done_read_range(first_row)) if skip < len(days) else []
+    _done_cache["cold_at"] = started
+    return fresh, first_row
+
+
+def _done_cache_roll(since: str):
+    """Сменился день: строки старше since выкидываем из снимка, лист не перечитываем."""
+    rows = _done_cache["rows"] or []
+    _done_cache["rows"] = [r for r in rows if r[1] >= since]
+    _done_cache["since"] = since
+
+
+def load_done_rows() -> Optional[List[List[str]]]:
+    """Строки done_log за сегодня/вчера (колонки A..F) плюс ещё не записанные отметки; None если лист прочитать не удалось.
+
+    Отметки из очереди отдаются как есть (вместе с колонками фото) — те же объекты от вызова к вызову,
+    поэтому _done_index дозаполняет индекс, а не строит его заново.
+    """
+    with _done_read_lock:
+        since = _done_since()
+        if _done_cache["rows"] is not None and _done_cache["since"] != since:
+            _done_cache_roll(since)
+        rows = _done_cache["rows"]
+        now = monotonic()
+        stale = now - _done_cache["at"] > DONE_CACHE_TTL_SECONDS
+        if rows is None or (stale and not _done_tail_ok(now)):
+            try:
+                _done_cache_store(*_done_read_recent(since), since)
+            except Exception:
+                if rows is None:
+                    return None
+                log.warning("Не смог перечитать done_log, отдаю прежний снимок")
+        elif stale:
+            next_row = _done_cache["next_row"]
+            try:
+                _done_cache_store(sheet_get(done_read_range(next_row)), next_row, since, base=rows)
+            except Exception:
+                # next_row за пределами сетки листа и т.п. — перечитываем заново
+                try:
+                    _done_cache_store(*_done_read_recent(since), since)
+                except Exception:
+                    return None
+    rows = _done_cache["rows"]
+    pending = pending_appends(SHEET_DONE)
+    return rows + pending if pending else rows
+
+
+# (день, точка) -> закрытые task_id; (день, точка, user_id) -> ISO-время последней отметки
+DoneIndex = Tuple[Dict[Tuple[str, str], set[str]], Dict[Tuple[str, str, str], str]]
+# seen — снимок rows, по которому индекс заполнен; снимки done_log только дописываются в конец
+_done_index_memo: Dict[str, Any] = {"seen": None, "index": None}
+_done_index_lock = threading.Lock()
+
+
+def _done_index_add(index: DoneIndex, rows: List[List[str]]):
+    ids, last = index
     for r in rows:
-        if len(r) < 7:
-            continue
-        if r[1] != day:
+        if len(r) < 4:
             continue
-        if normalize_point(r[2]) != p:
+        p = normalize_point(r[2])
+        if len(r) >= 6 and r[5]:
+            ids.setdefault((r[1], p), set()).add(r[5])
+        # время пишет бот сам (now_tz().isoformat, один пояс) — такие строки сравниваются как даты,
+        # поэтому в цикле не разбираем каждую, а только победителя в parse_action_ts
+        ts = r[0]
+        if not ts[:1].isdigit():
             continue
-        tid = r[5] if len(r) > 5 else ""
-        if tid:
-            out.add(tid)
-    return out
+        key = (r[1], p, r[3])
+        prev = last.get(key)
+        if prev is None or ts > prev:
+            last[key] = ts
+
 
+def _done_index(rows: List[List[str]]) -> DoneIndex:
+    """Индекс по done_log за один проход; на новом снимке доразбираются только дописанные строки.
 
-def last_task_action_ts(day: str, point: str, user_id: int) -> Optional[datetime]:
-    """Последняя отметка задачи этим пользователем на точке/день."""
+    Множества и максимумы не зависят от порядка и повторов, поэтому строка, попавшая в индекс
+    из очереди, а потом прочитанная из листа, ничего не портит. Если начало снимка сменилось
+    (смена дня, полное перечитывание) — индекс строится заново.
+    """
+    with _done_index_lock:
+        seen = _done_index_memo["seen"]
+        if seen is rows:
+            return _done_index_memo["index"]
+        n = len(seen) if seen else 0
+        if n and len(rows) >= n and rows[0] is seen[0] and rows[n - 1] is seen[n - 1]:
+            index = _done_index_memo["index"]
+            _done_index_add(index, rows[n:])
+        else:
+            index = ({}, {})
+            _done_index_add(index, rows)
+        _done_index_memo["seen"] = rows
+        _done_index_memo["index"] = index
+        return index
+
+
+def get_done_task_ids(day: str, point: str, rows: Optional[List[List[str]]] = None) -> set[str]:
+    """Глобально на точке/день: какие task_id уже закрыты (независимо от сотрудника).
+
+    rows — уже прочитанный done_log (load_done_rows), чтобы не читать лист повторно.
+    """
+    if rows is None:
+        rows = load_done_rows()
+    if rows is None:
+        return set()
+    return set(_done_index(rows)[0].get((day, normalize_point(point)), ()))
+
+
+def tasks_with_done_ids(day: str, point: str) -> Tuple[List[Task], set[str]]:
+    """План точки на сегодня и закрытые task_id — одним заходом в SHEETS_POOL (оба из кэшей)."""
+    return load_tasks_for_today(point), get_done_task_ids(day, point)
+
+
+def parse_action_ts(ts: Optional[str]) -> Optional[datetime]:
+    if not ts:
+        return None
     try:
-        rows = sheet_get(f"{SHEET_DONE}!A2:J")
+        return datetime.fromisoformat(ts)
     except Exception:
         return None
-    p = normalize_point(point)
-    last: Optional[datetime] = None
-    uid = str(user_id)
-    for r in rows:
-        if len(r) < 4:
-            continue
-        if r[1] != day:
-            continue
-        if normalize_point(r[2]) != p:
-            continue
-        if r[3] != uid:
-            continue
-        try:
-            ts = datetime.fromisoformat(r[0])
-        except Exception:
-            continue
-        if (last is None) or (ts > last):
-            last = ts
-    return last
 
 
 # -------------------- SHIFT SESSIONS --------------------
@@ -640,16 +1354,58 @@ def make_session_id(day: str, point: str) -> str:
     return f"{day}|{normalize_point(point)}"
 
 
+_sessions_cache: Dict[str, Any] = {"rows": None, "at": 0.0, "index": None}
+
+
+def invalidate_sessions_cache():
+    _sessions_cache["rows"] = None
+    _sessions_cache["index"] = None
+
+
+def _sessions_cache_put(idx: Optional[int], sess: Session, row: List[str]):
+    """Записали строку смены сами — подменяем её в снимке и в индексе открытых смен.
+
+    Как и _users_cache_put: снимок и индекс не мутируем, а подменяем копиями; "at" не трогаем.
+    Без этого каждое открытие/закрытие смены стоило бы полного перечитывания shift_sessions
+    при следующем нажатии кнопки (main_menu → user_open_context).
+    """
+    rows = _sessions_cache["rows"]
+    if rows is None:
+        return
+    if idx is None or idx < 1 or idx > len(rows) + 1:
+        invalidate_sessions_cache()
+        return
+    new_rows = list(rows)
+    if idx == len(rows) + 1:
+        new_rows.append(row)
+    else:
+        new_rows[idx - 1] = row
+    memo = _sessions_cache["index"]
+    new_memo = None
+    if memo and memo[0] is rows:
+        _rows, d, index = memo
+        new_index = {uid: hit for uid, hit in index.items() if hit[0].session_id != sess.session_id}
+        if sess.day == d:
+            for uid, role in _session_roles(sess):
+                new_index.setdefault(uid, (replace(sess), role))
+        new_memo = (new_rows, d, new_index)
+    _sessions_cache["rows"] = new_rows
+    _sessions_cache["index"] = new_memo
+
+
 def _sessions_rows() -> Tuple[List[List[str]], bool]:
-    rows = sheet_get(SHEET_SESSIONS)
+    rows = cached_sheet_get(_sessions_cache, SHEET_SESSIONS, SESSIONS_CACHE_TTL_SECONDS)
     if not rows:
         return [], False
-    has_header = is_header(rows[0], "session_id")
+    has_header = _cached_header_flag(_sessions_cache, rows, "session_id")
     return rows, has_header
 
 
-def get_session(day: str, point: str) -> Tuple[Optional[Session], Optional[int]]:
-    rows, has_header = _sessions_rows()
+SessionsRows = Tuple[List[List[str]], bool]
+
+
+def get_session(day: str, point: str, sessions_rows: Optional[SessionsRows] = None) -> Tuple[Optional[Session], Optional[int]]:
+    rows, has_header = sessions_rows if sessions_rows is not None else _sessions_rows()
     if not rows:
         return None, None
     start = 1 if has_header else 0
@@ -666,52 +1422,107 @@ def get_session(day: str, point: str) -> Tuple[Optional[Session], Optional[int]]
     return None, None
 
 
-def upsert_session(sess: Session):
+# одна сессия на точку/день: поиск строки и запись не должны перемешиваться между потоками,
+# иначе два параллельных открытия допишут две строки
+_sessions_write_lock = threading.Lock()
+
+
+def upsert_session(sess: Session, idx: Optional[int] = None):
+    """idx — номер строки, если вызывающий уже нашёл её через get_session (тогда лист не перечитываем)."""
     ts = now_tz().isoformat(timespec="seconds")
     sess.updated_at = ts
-    existing, idx = get_session(sess.day, sess.point)
-    row = list(sess.__dict__.values())
-    if existing is None or idx is None:
-        sheet_append(SHEET_SESSIONS, row)
-    else:
-        sheet_update(f"{SHEET_SESSIONS}!A{idx}:O{idx}", row)
+    with _sessions_write_lock:
+        existing = sess
+        if idx is None:
+            existing, idx = get_session(sess.day, sess.point)
+        row = list(sess.__dict__.values())
+        try:
+            if existing is None or idx is None:
+                idx = sheet_append(SHEET_SESSIONS, row)
+            else:
+                sheet_update(f"{SHEET_SESSIONS}!A{idx}:O{idx}", row)
+        except Exception:
+            invalidate_sessions_cache()
+            raise
+        _sessions_cache_put(idx, sess, row)
 
 
-def list_open_sessions() -> List[Session]:
-    rows, has_header = _sessions_rows()
+def list_open_sessions(sessions_rows: Optional[SessionsRows] = None) -> List[Session]:
+    rows, has_header = sessions_rows if sessions_rows is not None else _sessions_rows()
     if not rows:
         return []
     start = 1 if has_header else 0
+    n = len(SESSIONS_HEADER)
     out: List[Session] = []
     for r in rows[start:]:
-        if not r:
+        # state (колонка E) смотрим до сборки Session: закрытых смен — почти вся история листа
+        if len(r) < 5 or not r[4] or r[4] == "CLOSED":
             continue
-        while len(r) < len(SESSIONS_HEADER):
-            r.append("")
         try:
-            s = Session(*r[:len(SESSIONS_HEADER)])
+            out.append(Session(*(r[:n] + [""] * (n - len(r)))))
         except Exception:
             continue
-        if s.state and s.state != "CLOSED":
-            out.append(s)
     return out
 
 
-def user_open_context(user_id: int) -> Tuple[Optional[Session], Optional[str]]:
-    """Возвращает (session, role) где role: 'FULL', 'HALF1', 'HALF2'."""
+def user_open_context(user_id: int, sessions_rows: Optional[SessionsRows] = None) -> Tuple[Optional[Session], Optional[str]]:
+    """Возвращает (session, role) где role: 'FULL', 'HALF1', 'HALF2'.
+
+    sessions_rows — уже прочитанный shift_sessions (_sessions_rows), если он нужен обработчику ещё раз.
+    """
+    return _open_context_result(_open_sessions_by_user(sessions_rows).get(str(user_id)))
+
+
+def _open_context_result(hit: Optional[Tuple[Session, str]]) -> Tuple[Optional[Session], Optional[str]]:
+    if not hit:
+        return None, None
+    sess, role = hit
+    # копия: обработчики меняют поля сессии перед upsert_session, а индекс общий
+    return replace(sess), role
+
+
+async def open_context(user_id: int) -> Tuple[Optional[Session], Optional[str]]:
+    """user_open_context для обработчиков: при свежем снимке и готовом индексе отвечает сразу в event loop,
+    без захода в SHEETS_POOL (так почти на каждом нажатии); иначе читает лист в пуле."""
+    memo = _sessions_cache["index"]
+    if (
+        memo
+        and memo[0] is _sessions_cache["rows"]
+        and memo[1] == day_key()
+        and not cache_stale(_sessions_cache, SESSIONS_CACHE_TTL_SECONDS)
+    ):
+        return _open_context_result(memo[2].get(str(user_id)))
+    return await run_sheets(user_open_context, user_id)
+
+
+def _open_sessions_by_user(sessions_rows: Optional[SessionsRows] = None) -> Dict[str, Tuple[Session, str]]:
+    """Индекс user_id -> (сессия, роль) по открытым сменам сегодня; пересобирается при обновлении листа."""
+    if sessions_rows is None:
+        sessions_rows = _sessions_rows()
     d = day_key()
-    sessions = list_open_sessions()
-    for s in sessions:
+    cached = _sessions_cache["index"]
+    if cached and cached[0] is sessions_rows[0] and cached[1] == d:
+        return cached[2]
+    index: Dict[str, Tuple[Session, str]] = {}
+    for s in list_open_sessions(sessions_rows):
         if s.day != d:
             continue
-        if s.mode == "FULL" and s.state == "OPEN_FULL" and s.user1_id == str(user_id):
-            return s, "FULL"
-        if s.mode == "HALF":
-            if s.state == "OPEN1" and s.user1_id == str(user_id):
-                return s, "HALF1"
-            if s.state == "OPEN2" and s.user2_id == str(user_id):
-                return s, "HALF2"
-    return None, None
+        for uid, role in _session_roles(s):
+            index.setdefault(uid, (s, role))
+    _sessions_cache["index"] = (sessions_rows[0], d, index)
+    return index
+
+
+def _session_roles(s: Session) -> List[Tuple[str, str]]:
+    """Кто сейчас на смене s и в какой роли (пусто, если смена закрыта или ждёт передачи)."""
+    if s.mode == "FULL" and s.state == "OPEN_FULL":
+        return [(s.user1_id, "FULL")]
+    if s.mode == "HALF":
+        if s.state == "OPEN1":
+            return [(s.user1_id, "HALF1")]
+        if s.state == "OPEN2":
+            return [(s.user2_id, "HALF2")]
+    return []
 
 
 # -------------------- WORK HOURS / CLOSE BUTTON --------------------
@@ -723,23 +1534,24 @@ WORK_HOURS = {
     "Музей": (time(9, 0), time(19, 0)),
     "Сочнева": (time(14, 0), time(23, 0)),
 }
+DEFAULT_WORK_HOURS = (time(10, 0), time(22, 0))
 
 
 def point_hours(point: str) -> Tuple[time, time]:
     p = normalize_point(point)
-    return WORK_HOURS.get(p, (time(10, 0), time(22, 0)))
+    return WORK_HOURS.get(p, DEFAULT_WORK_HOURS)
 
 
-def can_close_now(point: str) -> bool:
+def can_close_now(point: str, now: Optional[datetime] = None) -> bool:
     _start, end = point_hours(point)
-    now = now_tz().time()
-    return now >= end
+    t = (now or now_tz()).time()
+    return t >= end
 
 
-def in_work_hours(point: str) -> bool:
+def in_work_hours(point: str, now: Optional[datetime] = None) -> bool:
     start, end = point_hours(point)
-    now = now_tz().time()
-    return start <= now <= end
+    t = (now or now_tz()).time()
+    return start <= t <= end
 
 
 # -------------------- UI BUILDERS --------------------
@@ -749,24 +1561,43 @@ def kb_single(label: str, cb: str) -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup([[InlineKeyboardButton(label, callback_data=cb)]])
 
 
-def points_kb(points: List[str], prefix: str = "POINT") -> InlineKeyboardMarkup:
+# Клавиатуры неизменяемые (TelegramObject frozen), поэтому их можно собрать один раз и переиспользовать.
+
+
+def points_kb(points: Sequence[str], prefix: str = "POINT") -> InlineKeyboardMarkup:
+    return _points_kb_cached(tuple(points), prefix)
+
+
+@lru_cache(maxsize=32)
+def _points_kb_cached(points: Tuple[str, ...], prefix: str) -> InlineKeyboardMarkup:
     rows = [[InlineKeyboardButton(p, callback_data=f"{prefix}|{i}")] for i, p in enumerate(points)]
     return InlineKeyboardMarkup(rows)
 
 
+_AFTER_APPROVED_KB = kb_single("📍 Сменить точку", "CHOOSE_POINT")
+
+# Строгая логика: после выбора точки — только 2 кнопки открытия смены
+_OPEN_CHOICE_KB = InlineKeyboardMarkup([
+    [InlineKeyboardButton("🔓 Открыть смену (полная)", callback_data="OPEN|FULL")],
+    [InlineKeyboardButton("⏱️ Открыть пол смены", callback_data="OPEN|HALF")],
+])
+
+
 def after_approved_kb() -> InlineKeyboardMarkup:
-    return kb_single("📍 Сменить точку", "CHOOSE_POINT")
+    return _AFTER_APPROVED_KB
 
 
 def open_choice_kb() -> InlineKeyboardMarkup:
-    # Строгая логика: после выбора точки — только 2 кнопки открытия смены
-    return InlineKeyboardMarkup([
-        [InlineKeyboardButton("🔓 Открыть смену (полная)", callback_data="OPEN|FULL")],
-        [InlineKeyboardButton("⏱️ Открыть пол смены", callback_data="OPEN|HALF")],
-    ])
+    return _OPEN_CHOICE_KB
+
+
+def shift_kb(role: str, point: str) -> InlineKeyboardMarkup:
+    # меню смены зависит только от роли (FULL / HALF1 / HALF2)
+    return _shift_kb_for_role(role)
 
 
-def shift_kb(role: str, point: str) -> InlineKeyboardMarkup:
+@lru_cache(maxsize=8)
+def _shift_kb_for_role(role: str) -> InlineKeyboardMarkup:
     rows = [
         [InlineKeyboardButton("🧾 План задач", callback_data="PLAN")],
         [InlineKeyboardButton("✅ Отметить выполненную задачу", callback_data="MARK")],
@@ -780,16 +1611,35 @@ def shift_kb(role: str, point: str) -> InlineKeyboardMarkup:
 
 
 def tasks_kb(tasks: List[Task], done_ids: set[str]) -> InlineKeyboardMarkup:
+    # разметка зависит только от названий и отметок — список задач на день стабилен, клавиатуры повторяются
+    return _tasks_kb_cached(tuple((t.task_name, t.task_id in done_ids) for t in tasks))
+
+
+@lru_cache(maxsize=128)
+def _tasks_kb_cached(items: Tuple[Tuple[str, bool], ...]) -> InlineKeyboardMarkup:
     rows: List[List[InlineKeyboardButton]] = []
-    for i, t in enumerate(tasks):
-        status = "✅" if t.task_id in done_ids else "⬜"
-        label = f"{status} {t.task_name}"
+    for i, (name, done) in enumerate(items):
+        status = "✅" if done else "⬜"
+        label = f"{status} {name}"
         if len(label) > 48:
             label = label[:45] + "…"
         rows.append([InlineKeyboardButton(label, callback_data=f"TASK|{i}")])
     return InlineKeyboardMarkup(rows)
 
 
+SKIP_TASK_PHOTO2_KB = kb_single("Пропустить фото 2", "SKIP_TASK_PHOTO2")
+HELP_CANCEL_KB = kb_single("❌ Отмена", "HELP_CANCEL")
+HELP_SEND_KB = InlineKeyboardMarkup([
+    [InlineKeyboardButton("✅ Отправить", callback_data="HELP_SEND")],
+    [InlineKeyboardButton("❌ Отмена", callback_data="HELP_CANCEL")],
+])
+HELP_TEXT_DONE_KB = InlineKeyboardMarkup([
+    [InlineKeyboardButton("✅ Отправить", callback_data="HELP_SEND")],
+    [InlineKeyboardButton("✅ Отправить без фото", callback_data="HELP_SEND")],
+    [InlineKeyboardButton("❌ Отмена", callback_data="HELP_CANCEL")],
+])
+
+
 def approve_kb(user_id: int) -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup([
         [
@@ -846,7 +1696,17 @@ def parse_money(s: str) -> Optional[float]:
 async def guard_employee(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Optional[UserRec]:
     """Единая проверка доступа для сотрудников (не для админ-команд в группе)."""
     uid = update.effective_user.id if update.effective_user else 0
-    u = get_user(uid)
+    # активный сотрудник запоминается в user_data вместе со снимком users, из которого прочитан:
+    # пока снимок тот же и свежий (любая запись бота или перечитывание его меняют), поток не нужен
+    cached = context.user_data.get("_active_user")
+    if (
+        cached
+        and cached[0] is _users_cache["rows"]
+        and monotonic() - _users_cache["at"] <= USERS_CACHE_TTL_SECONDS
+    ):
+        return cached[1]
+    context.user_data.pop("_active_user", None)
+    snapshot, u = await run_sheets(get_user_with_snapshot, uid)
     if not u:
         # не зарегистрирован
         if update.message:
@@ -869,6 +1729,10 @@ async def guard_employee(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             await update.callback_query.answer()
             await update.callback_query.edit_message_text("Заявка на одобрении. Ждём 🙂")
         return None
+    # запоминаем только вместе со снимком, из которого u прочитан: если снимок успел смениться
+    # (например, сотрудника только что заблокировали), старую запись к новому снимку не привязываем
+    if snapshot is not None and snapshot is _users_cache["rows"]:
+        context.user_data["_active_user"] = (snapshot, u)
     return u
 
 
@@ -877,7 +1741,7 @@ async def guard_employee(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 
 async def start_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     uid = update.effective_user.id
-    u = get_user(uid)
+    u = await run_sheets(get_user, uid)
 
     if u and u.status == STATUS_BLOCKED:
         await update.message.reply_text("Доступ к боту заблокирован администратором.")
@@ -890,7 +1754,7 @@ async def start_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if u and u.status == STATUS_ACTIVE:
         # знакомый
         text = "А я тебя помню! 🙂"
-        sess, role = user_open_context(uid)
+        sess, role = await open_context(uid)
         if sess and role:
             point = normalize_point(sess.point)
             await update.message.reply_text(text + f"\n\nСмена уже открыта на точке: {point}", reply_markup=shift_kb(role, point))
@@ -928,26 +1792,35 @@ async def reg_code(update: Update, context: ContextTypes.DEFAULT_TYPE):
     uid = update.effective_user.id
     name = context.user_data.get("reg_name", update.effective_user.full_name)
 
-    upsert_user(uid, name, point="", status=STATUS_PENDING)
+    await run_sheets(upsert_user, uid, name, point="", status=STATUS_PENDING)
 
     await update.message.reply_text(
         "Заявка отправлена в группу контроля ✅\n"
         "Как только одобрят — я напишу тебе сюда.",
     )
 
-    # в контроль
-    await report_to_control(
+    async def send_approve_buttons():
+        # кнопки одобрения нужны всегда (не отчёт): предохранитель не проверяем, только учитываем исход
+        try:
+            await context.bot.send_message(
+                chat_id=CONTROL_GROUP_ID,
+                text=f"🆕 Запрос регистрации\nИмя: {name}\nID: {uid}\n\nОдобрить?",
+                reply_markup=approve_kb(uid),
+            )
+            control_sent()
+        except Exception as e:
+            control_failed(e)
+            log.warning("Не смог отправить approval-кнопки: %s", e)
+
+    # в контроль — фоном: обработка следующих апдейтов не ждёт отправки в группу
+    report_in_background(
         context,
-        format_control("🆕 Запрос регистрации", name, uid, details=["Нажмите кнопку ниже:"]),
+        report_to_control(
+            context,
+            format_control("🆕 Запрос регистрации", name, uid, details=["Нажмите кнопку ниже:"]),
+        ),
+        send_approve_buttons(),
     )
-    try:
-        await context.bot.send_message(
-            chat_id=CONTROL_GROUP_ID,
-            text=f"🆕 Запрос регистрации\nИмя: {name}\nID: {uid}\n\nОдобрить?",
-            reply_markup=approve_kb(uid),
-        )
-    except Exception as e:
-        log.warning("Не смог отправить approval-кнопки: %s", e)
 
     return ConversationHandler.END
 
@@ -978,35 +1851,40 @@ async def admin_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await q.edit_message_text("Некорректная команда.")
         return
 
-    u = get_user(uid)
+    u = await run_sheets(get_user, uid)
     if not u:
         await q.edit_message_text("Пользователь не найден в таблице users.")
         return
 
     if action == "APPROVE":
-        set_user_status(uid, STATUS_ACTIVE)
-        await q.edit_message_text(f"✅ Одобрено: {u.name} ({uid})")
+        await run_sheets(set_user_status, uid, STATUS_ACTIVE)
 
-        # уведомить сотрудника
-        try:
-            await context.bot.send_message(
+        # отчёт в контроль — фоном; кнопку в группе и сообщение сотруднику — параллельно
+        report_in_background(context, report_to_control(context, format_control("✅ Сотрудник одобрен", u.name, uid)))
+        res_edit, res_user = await asyncio.gather(
+            q.edit_message_text(f"✅ Одобрено: {u.name} ({uid})"),
+            context.bot.send_message(
                 chat_id=uid,
                 text="✅ Тебя одобрили!\nТеперь выбери точку (можно менять в любой момент, когда смена закрыта):",
                 reply_markup=after_approved_kb(),
-            )
-        except Exception as e:
-            log.warning("Не смог написать пользователю после approve: %s", e)
-
-        await report_to_control(context, format_control("✅ Сотрудник одобрен", u.name, uid))
+            ),
+            return_exceptions=True,
+        )
+        if isinstance(res_edit, Exception):
+            log.warning("Не смог обновить заявку в контроле: %s", res_edit)
+        if isinstance(res_user, Exception):
+            log.warning("Не смог написать пользователю после approve: %s", res_user)
 
     elif action == "BLOCK":
-        set_user_status(uid, STATUS_BLOCKED)
-        await q.edit_message_text(f"⛔️ Заблокирован: {u.name} ({uid})")
-        try:
-            await context.bot.send_message(chat_id=uid, text="⛔️ Доступ к боту заблокирован администратором.")
-        except Exception:
-            pass
-        await report_to_control(context, format_control("⛔️ Сотрудник заблокирован", u.name, uid))
+        await run_sheets(set_user_status, uid, STATUS_BLOCKED)
+        report_in_background(context, report_to_control(context, format_control("⛔️ Сотрудник заблокирован", u.name, uid)))
+        res_edit, _ = await asyncio.gather(
+            q.edit_message_text(f"⛔️ Заблокирован: {u.name} ({uid})"),
+            context.bot.send_message(chat_id=uid, text="⛔️ Доступ к боту заблокирован администратором."),
+            return_exceptions=True,
+        )
+        if isinstance(res_edit, Exception):
+            log.warning("Не смог обновить заявку в контроле: %s", res_edit)
 
 
 # -------------------- ADMIN COMMANDS (control group only) --------------------
@@ -1023,11 +1901,11 @@ async def cmd_block(update: Update, context: ContextTypes.DEFAULT_TYPE):
     except Exception:
         await update.message.reply_text("user_id должен быть числом.")
         return
-    u = get_user(uid)
+    u = await run_sheets(get_user, uid)
     if not u:
         await update.message.reply_text("Не найден в users.")
         return
-    set_user_status(uid, STATUS_BLOCKED)
+    await run_sheets(set_user_status, uid, STATUS_BLOCKED)
     await update.message.reply_text(f"⛔️ Заблокирован: {u.name} ({uid})")
     try:
         await context.bot.send_message(chat_id=uid, text="⛔️ Доступ к боту заблокирован администратором.")
@@ -1046,23 +1924,21 @@ async def cmd_unblock(update: Update, context: ContextTypes.DEFAULT_TYPE):
     except Exception:
         await update.message.reply_text("user_id должен быть числом.")
         return
-    u = get_user(uid)
+    u = await run_sheets(get_user, uid)
     if not u:
         await update.message.reply_text("Не найден в users.")
         return
     # если был заблокирован — делаем активным (если был pending — оставим pending)
     new_status = STATUS_ACTIVE if u.status == STATUS_BLOCKED else u.status
-    set_user_status(uid, new_status)
+    await run_sheets(set_user_status, uid, new_status)
     await update.message.reply_text(f"✅ Разблокирован: {u.name} ({uid}), статус: {new_status}")
 
 
-async def cmd_pending(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if update.message.chat_id != CONTROL_GROUP_ID:
-        return
+def list_pending_users() -> Optional[List[UserRec]]:
+    """Заявки на одобрении; None — лист users пустой."""
     rows, has_header = _users_rows()
     if not rows:
-        await update.message.reply_text("users пустой.")
-        return
+        return None
     start = 1 if has_header else 0
     pending: List[UserRec] = []
     for r in rows[start:]:
@@ -1074,6 +1950,16 @@ async def cmd_pending(update: Update, context: ContextTypes.DEFAULT_TYPE):
             continue
         if u.status == STATUS_PENDING:
             pending.append(u)
+    return pending
+
+
+async def cmd_pending(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.message.chat_id != CONTROL_GROUP_ID:
+        return
+    pending = await run_sheets(list_pending_users)
+    if pending is None:
+        await update.message.reply_text("users пустой.")
+        return
     if not pending:
         await update.message.reply_text("На одобрении никого нет.")
         return
@@ -1095,13 +1981,14 @@ async def choose_point_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     # Строгая логика: если смена уже открыта — выбор точки запрещён
-    sess, role = user_open_context(u.user_id)
+    sess, role = await open_context(u.user_id)
     if sess and role:
         point = normalize_point(sess.point)
         await q.edit_message_text("Смена уже открыта. Действуй по кнопкам ниже.", reply_markup=shift_kb(role, point))
         return
 
-    pts = load_points()
+    pts = await run_sheets(load_points)
+    # ссылка на общий кортеж, не копия: индекс из кнопки разбираем по тому списку, что видел пользователь
     context.user_data["points_list"] = pts
     await q.edit_message_text("Выбери точку:", reply_markup=points_kb(pts, prefix="POINT"))
 
@@ -1115,13 +2002,13 @@ async def point_pick_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     # Строгая логика: если смена уже открыта — смена точки запрещена
-    sess, role = user_open_context(u.user_id)
+    sess, role = await open_context(u.user_id)
     if sess and role:
         point = normalize_point(sess.point)
         await q.edit_message_text("Смена уже открыта. Сменить точку нельзя.", reply_markup=shift_kb(role, point))
         return
 
-    pts = context.user_data.get("points_list") or load_points()
+    pts = context.user_data.get("points_list") or await run_sheets(load_points)
     try:
         _p, idx_s = q.data.split("|", 1)
         point = pts[int(idx_s)]
@@ -1129,11 +2016,15 @@ async def point_pick_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await q.edit_message_text("Не понял выбор. Нажми «Выбор точки» ещё раз.", reply_markup=after_approved_kb())
         return
 
-    set_user_point(u.user_id, point)
-    u = get_user(u.user_id) or u
+    # имя и id после смены точки не меняются — перечитывать пользователя не нужно
+    await run_sheets(set_user_point, u.user_id, point)
+    point = normalize_point(point)
 
-    await q.edit_message_text(f"Точка выбрана: {normalize_point(point)}\n\nТеперь выбери вариант открытия смены:", reply_markup=open_choice_kb())
-    await report_to_control(context, format_control("📍 Сотрудник выбрал точку", u.name, u.user_id, point=normalize_point(point)))
+    await q.edit_message_text(f"Точка выбрана: {point}\n\nТеперь выбери вариант открытия смены:", reply_markup=open_choice_kb())
+    report_in_background(
+        context,
+        report_to_control(context, format_control("📍 Сотрудник выбрал точку", u.name, u.user_id, point=point)),
+    )
 
 
 async def back_to_point_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -1168,8 +2059,9 @@ async def open_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if mode not in ("FULL", "HALF"):
         mode = "FULL"
     context.user_data["open_shift_mode"] = mode
-    existing, _ = get_session(d, point)
-    _, role = user_open_context(u.user_id)
+    sessions_rows = await run_sheets(_sessions_rows)
+    existing, _ = get_session(d, point, sessions_rows)
+    _, role = await run_sheets(user_open_context, u.user_id, sessions_rows)
     if role:
         await q.edit_message_text("У тебя уже есть открытая смена.", reply_markup=shift_kb(role, point))
         return
@@ -1227,13 +2119,14 @@ async def open_full_start_cb(update: Update, context: ContextTypes.DEFAULT_TYPE)
     context.user_data["open_shift_mode"] = mode
 
     # если у пользователя уже есть открытая смена — запрещаем
-    sess_open, role = user_open_context(u.user_id)
+    sessions_rows = await run_sheets(_sessions_rows)
+    sess_open, role = await run_sheets(user_open_context, u.user_id, sessions_rows)
     if role:
         p = normalize_point(sess_open.point) if sess_open else point
         await q.edit_message_text("У тебя уже есть открытая смена.", reply_markup=shift_kb(role, p))
         return ConversationHandler.END
 
-    existing, _ = get_session(d, point)
+    existing, _ = get_session(d, point, sessions_rows)
     if existing and existing.state != "CLOSED":
         if existing.mode == "FULL":
             await q.edit_message_text(
@@ -1322,7 +2215,7 @@ async def open_full_macarons_photo(update: Update, context: ContextTypes.DEFAULT
     d = context.user_data.get("open_full_day") or day_key()
 
     # защитная проверка: на всякий случай
-    existing, _ = get_session(d, point)
+    existing, _ = await run_sheets(get_session, d, point)
     if existing and existing.state != "CLOSED":
         context.user_data.pop("open_full_point", None)
         context.user_data.pop("open_full_day", None)
@@ -1342,7 +2235,7 @@ async def open_full_macarons_photo(update: Update, context: ContextTypes.DEFAULT
     mode = context.user_data.get("open_shift_mode") or "FULL"
     if mode == "HALF":
         # половина смены: делим задачи и открываем OPEN1
-        tasks = load_tasks_for_today(point)
+        tasks = await run_sheets(load_tasks_for_today, point)
         _part1, _part2, split_index = split_tasks_half(tasks)
         sess = Session(
             session_id=make_session_id(d, point),
@@ -1379,7 +2272,7 @@ async def open_full_macarons_photo(update: Update, context: ContextTypes.DEFAULT
             split_index="",
             updated_at=ts,
         )
-    upsert_session(sess)
+    await run_sheets(upsert_session, sess)
 
     # очистка временных полей открытия
     context.user_data.pop("open_full_point", None)
@@ -1394,30 +2287,27 @@ async def open_full_macarons_photo(update: Update, context: ContextTypes.DEFAULT
         details.append("Отчет витрины:")
         details.append(report_text[:1500])
 
-    await report_to_control(
+    showcase_cap = f"📸 Витрина (готовность)\nТочка: {point}\nСотрудник: {u.name} ({u.user_id})"
+    if report_text:
+        showcase_cap += f"\n\nОтчет:\n{report_text[:800]}"
+    report_in_background(
         context,
-        format_control(
-            ("⏱️ Открыта пол смены" if mode == "HALF" else "🔓 Открыта смена (полная)"),
-            u.name,
-            u.user_id,
-            point=point,
-            details=details,
+        report_with_photos_to_control(
+            context,
+            format_control(
+                ("⏱️ Открыта пол смены" if mode == "HALF" else "🔓 Открыта смена (полная)"),
+                u.name,
+                u.user_id,
+                point=point,
+                details=details,
+            ),
+            [
+                (photo_showcase, showcase_cap),
+                (photo_macarons, f"📸 Макаронс (срок годности и вкусы)\nТочка: {point}\nСотрудник: {u.name} ({u.user_id})"),
+            ],
         ),
     )
 
-    if photo_showcase:
-        cap = f"📸 Витрина (готовность)\nТочка: {point}\nСотрудник: {u.name} ({u.user_id})"
-        if report_text:
-            cap += f"\n\nОтчет:\n{report_text[:800]}"
-        await report_photo_to_control(context, photo_showcase, caption=cap)
-
-    if photo_macarons:
-        await report_photo_to_control(
-            context,
-            photo_macarons,
-            caption=f"📸 Макаронс (срок годности и вкусы)\nТочка: {point}\nСотрудник: {u.name} ({u.user_id})",
-        )
-
     await update.message.reply_text(
         f"Смена открыта ✅\nТочка: {point}",
         reply_markup=shift_kb("HALF1", point) if mode == "HALF" else shift_kb("FULL", point),
@@ -1433,11 +2323,79 @@ def _extract_photo_file_id(update: Update) -> Optional[str]:
         return update.message.photo[-1].file_id
     if update.message and update.message.document and update.message.document.mime_type:
         if update.message.document.mime_type.startswith("image/"):
+            remember_image_document(update.message.document.file_id)
             return update.message.document.file_id
     return None
 
 
+# Альбом (media group) приходит отдельными апдейтами подряд. Шаги сценария идут по каждому фото
+# (ConversationHandler ждёт апдейты по одному), а промежуточные «Принял ✅» откладываем: каждое
+# следующее фото альбома переносит ответ, и пользователь получает одно сообщение на альбом.
+ALBUM_ACK_DELAY_SECONDS = 0.5
+
+
+def _album_ack_name(update: Update) -> Optional[str]:
+    msg = update.message
+    if not msg or not msg.media_group_id:
+        return None
+    return f"album_ack:{msg.chat_id}:{msg.media_group_id}"
+
+
+async def _album_ack_job(context: ContextTypes.DEFAULT_TYPE):
+    chat_id, text, reply_markup = context.job.data
+    try:
+        await context.bot.send_message(chat_id=chat_id, text=text, reply_markup=reply_markup)
+    except Exception as e:
+        log.warning("Не смог ответить на альбом: %s", e)
+
+
+def drop_album_ack(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Итоговый ответ уже отправлен — отложенное «Принял» по этому альбому больше не нужно."""
+    name = _album_ack_name(update)
+    if name and context.job_queue:
+        for job in context.job_queue.get_jobs_by_name(name):
+            job.schedule_removal()
+
+
+async def album_ack(update: Update, context: ContextTypes.DEFAULT_TYPE, text: str, reply_markup: Any = None):
+    """Промежуточный ответ на фото: сразу для одиночного фото, один (последний) на альбом."""
+    name = _album_ack_name(update)
+    if name is None or not context.job_queue:
+        await update.message.reply_text(text, reply_markup=reply_markup)
+        return
+    drop_album_ack(update, context)
+    context.job_queue.run_once(
+        _album_ack_job,
+        ALBUM_ACK_DELAY_SECONDS,
+        data=(update.message.chat_id, text, reply_markup),
+        name=name,
+    )
+
+
+# Фото «вне сценария» (или от незарегистрированных) — отвечаем не чаще раза в N секунд на пользователя
+PHOTO_FALLBACK_COOLDOWN_SECONDS = 30
+_photo_fallback_seen: Dict[int, float] = {}
+
+
+def _photo_fallback_throttled(user_id: int) -> bool:
+    now = monotonic()
+    last = _photo_fallback_seen.get(user_id)
+    if last is not None and now - last < PHOTO_FALLBACK_COOLDOWN_SECONDS:
+        return True
+    if len(_photo_fallback_seen) > 1000:
+        for k in [k for k, v in _photo_fallback_seen.items() if now - v >= PHOTO_FALLBACK_COOLDOWN_SECONDS]:
+            del _photo_fallback_seen[k]
+    _photo_fallback_seen[user_id] = now
+    return False
+
+
 async def photo_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # если фото сейчас ничего не ждёт — поток фото не должен превращаться в поток чтений users и ответов
+    expecting = context.user_data.get("await") in ("TASK_PHOTO1", "TASK_PHOTO2") or context.user_data.get("help_mode")
+    uid = update.effective_user.id if update.effective_user else 0
+    if not expecting and _photo_fallback_throttled(uid):
+        return
+
     u = await guard_employee(update, context)
     if not u:
         return
@@ -1460,11 +2418,13 @@ async def photo_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
             task_mark["photo1"] = file_id
             context.user_data["task_mark"] = task_mark
             context.user_data["await"] = "TASK_PHOTO2"
-            await update.message.reply_text(
+            await album_ack(
+                update,
+                context,
                 "Фото 1 принято ✅\n\n"
                 "Теперь пришли фото 2 (по желанию) 📸\n"
                 "или нажми «Пропустить».",
-                reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("Пропустить фото 2", callback_data="SKIP_TASK_PHOTO2")]]),
+                reply_markup=SKIP_TASK_PHOTO2_KB,
             )
             return
 
@@ -1472,6 +2432,7 @@ async def photo_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
             task_mark["photo2"] = file_id
             context.user_data["task_mark"] = task_mark
             # финализируем
+            drop_album_ack(update, context)
             await finalize_task_done(update, context, u, task_mark)
             return
 
@@ -1479,17 +2440,16 @@ async def photo_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if context.user_data.get("help_mode"):
         photos: List[str] = context.user_data.get("help_photos") or []
         if len(photos) >= 4:
-            await update.message.reply_text("Уже 4 фото. Нажми «Отправить» 🙂")
+            await album_ack(update, context, "Уже 4 фото. Нажми «Отправить» 🙂", reply_markup=HELP_SEND_KB)
             return
         photos.append(file_id)
         context.user_data["help_photos"] = photos
         left = 4 - len(photos)
-        await update.message.reply_text(
+        await album_ack(
+            update,
+            context,
             f"Фото добавлено ✅ (осталось до 4: {left})\nНажми «Отправить», когда закончишь.",
-            reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("✅ Отправить", callback_data="HELP_SEND")],
-                [InlineKeyboardButton("❌ Отмена", callback_data="HELP_CANCEL")],
-            ]),
+            reply_markup=HELP_SEND_KB,
         )
         return
 
@@ -1521,15 +2481,15 @@ async def plan_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not u:
         return
 
-    sess, role = user_open_context(u.user_id)
+    sess, role = await open_context(u.user_id)
     if not sess or not role:
         await q.edit_message_text("Смена не открыта. Выбери точку и открой смену.", reply_markup=open_choice_kb())
         return
 
     point = normalize_point(sess.point)
     day = sess.day
-    tasks, _part = assigned_tasks_for_user(sess, role, point)
-    done_ids = get_done_task_ids(day, point)
+    tasks, _part = await run_sheets(assigned_tasks_for_user, sess, role, point)
+    done_ids = await run_sheets(get_done_task_ids, day, point)
 
     if not tasks:
         await q.edit_message_text("На сегодня задач нет 🙂", reply_markup=shift_kb(role, point))
@@ -1550,20 +2510,20 @@ async def mark_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not u:
         return
 
-    sess, role = user_open_context(u.user_id)
+    sess, role = await open_context(u.user_id)
     if not sess or not role:
         await q.edit_message_text("Смена не открыта.", reply_markup=open_choice_kb())
         return
 
     point = normalize_point(sess.point)
     day = sess.day
-    tasks, part = assigned_tasks_for_user(sess, role, point)
+    tasks, part = await run_sheets(assigned_tasks_for_user, sess, role, point)
 
     if not tasks:
         await q.edit_message_text("Сегодня нечего отмечать 🙂", reply_markup=shift_kb(role, point))
         return
 
-    done_ids = get_done_task_ids(day, point)
+    done_ids = await run_sheets(get_done_task_ids, day, point)
     remaining = [t for t in tasks if t.task_id not in done_ids]
 
     if not remaining:
@@ -1583,7 +2543,7 @@ async def task_pick_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not u:
         return
 
-    sess, role = user_open_context(u.user_id)
+    sess, role = await open_context(u.user_id)
     if not sess or not role:
         await q.edit_message_text("Смена не открыта.", reply_markup=open_choice_kb())
         return
@@ -1601,7 +2561,7 @@ async def task_pick_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
     day = sess.day
 
     # защита от повторов (если кто-то уже отметил)
-    done_ids = get_done_task_ids(day, point)
+    done_ids = await run_sheets(get_done_task_ids, day, point)
     if item["task_id"] in done_ids:
         await q.edit_message_text("Эта задача уже отмечена ✅", reply_markup=shift_kb(role, point))
         return
@@ -1646,12 +2606,13 @@ async def finalize_task_done(update: Update, context: ContextTypes.DEFAULT_TYPE,
     photo1 = task_mark.get("photo1", "")
     photo2 = task_mark.get("photo2", "")
 
-    # лог в таблицу
+    # лог в таблицу (запись отложенная, пачкой с соседними отметками)
     log_done(day, point, user, task, part, photo1, photo2)
+    request_append_flush(context)
 
     # reset throttling ONLY when a task is marked done
     try:
-        flag = f"reminder_sent:{day}:{normalize_point(point)}:{user.user_id}"
+        flag = reminder_flag(day, normalize_point(point), user.user_id)
         context.bot_data[flag] = now_tz().isoformat(timespec="seconds")
     except Exception:
         pass
@@ -1661,32 +2622,36 @@ async def finalize_task_done(update: Update, context: ContextTypes.DEFAULT_TYPE,
     context.user_data.pop("task_mark", None)
 
     # контроль: сообщение + фото
-    await report_to_control(
+    report_in_background(
         context,
-        format_control(
-            "✅ Задача выполнена",
-            user.name,
-            user.user_id,
-            point=point,
-            details=[f"Задача: {task.task_name}", f"Часть смены: {part}"],
+        report_with_photos_to_control(
+            context,
+            format_control(
+                "✅ Задача выполнена",
+                user.name,
+                user.user_id,
+                point=point,
+                details=[f"Задача: {task.task_name}", f"Часть смены: {part}"],
+            ),
+            [
+                (photo1, f"📸 Отчет 1\nТочка: {point}\nЗадача: {task.task_name}\nСотрудник: {user.name} ({user.user_id})"),
+                (photo2, f"📸 Отчет 2\nТочка: {point}\nЗадача: {task.task_name}\nСотрудник: {user.name} ({user.user_id})"),
+            ],
         ),
     )
-    if photo1:
-        await report_photo_to_control(context, photo1, caption=f"📸 Отчет 1\nТочка: {point}\nЗадача: {task.task_name}\nСотрудник: {user.name} ({user.user_id})")
-    if photo2:
-        await report_photo_to_control(context, photo2, caption=f"📸 Отчет 2\nТочка: {point}\nЗадача: {task.task_name}\nСотрудник: {user.name} ({user.user_id})")
 
     # вернуть меню смены
-    sess, role = user_open_context(user.user_id)
+    sess, role = await open_context(user.user_id)
     if sess and role:
         text = f"Готово ✅\nОтметил: {task.task_name}"
+        kb = shift_kb(role, normalize_point(sess.point))
         if via_callback and update.callback_query:
             try:
-                await update.callback_query.edit_message_text(text, reply_markup=shift_kb(role, normalize_point(sess.point)))
+                await update.callback_query.edit_message_text(text, reply_markup=kb)
                 return
             except Exception:
                 pass
-        await (update.effective_message.reply_text(text, reply_markup=shift_kb(role, normalize_point(sess.point))))
+        await update.effective_message.reply_text(text, reply_markup=kb)
 
 
 # -------------------- HELP FLOW --------------------
@@ -1699,7 +2664,7 @@ async def help_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not u:
         return
 
-    sess, role = user_open_context(u.user_id)
+    sess, role = await open_context(u.user_id)
     if not sess or not role:
         await q.edit_message_text("Кнопка доступна только в рамках открытой смены.")
         return
@@ -1714,7 +2679,7 @@ async def help_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "Надеюсь новости хорошие!? 🙂\n"
         "Напиши всё что хочешь сказать и прикрепи фото если нужно.\n\n"
         "Сначала отправь ТЕКСТ одним сообщением.",
-        reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("❌ Отмена", callback_data="HELP_CANCEL")]]),
+        reply_markup=HELP_CANCEL_KB,
     )
 
 
@@ -1730,11 +2695,7 @@ async def help_text_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(
         "Текст принял ✅\n\nТеперь можешь отправить до 4 фото (по одному или альбомом).\n"
         "Когда закончишь — нажми «Отправить».",
-        reply_markup=InlineKeyboardMarkup([
-            [InlineKeyboardButton("✅ Отправить", callback_data="HELP_SEND")],
-            [InlineKeyboardButton("✅ Отправить без фото", callback_data="HELP_SEND")],
-            [InlineKeyboardButton("❌ Отмена", callback_data="HELP_CANCEL")],
-        ]),
+        reply_markup=HELP_TEXT_DONE_KB,
     )
 
 
@@ -1749,7 +2710,7 @@ async def help_send_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await q.edit_message_text("Нет активного запроса.")
         return
 
-    sess, role = user_open_context(u.user_id)
+    sess, role = await open_context(u.user_id)
     if not sess or not role:
         context.user_data.pop("help_mode", None)
         await q.edit_message_text("Смена не открыта, сообщение не отправлено.")
@@ -1759,18 +2720,23 @@ async def help_send_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
     text = context.user_data.get("help_text") or "(без текста)"
     photos: List[str] = context.user_data.get("help_photos") or []
 
-    await report_to_control(
+    report_in_background(
         context,
-        format_control(
-            "🤝 Красавчик помоги",
-            u.name,
-            u.user_id,
-            point=point,
-            details=[f"Сообщение: {text}"],
+        report_with_photos_to_control(
+            context,
+            format_control(
+                "🤝 Красавчик помоги",
+                u.name,
+                u.user_id,
+                point=point,
+                details=[f"Сообщение: {text}"],
+            ),
+            [
+                (pid, f"📸 Фото {i}\nТочка: {point}\nСотрудник: {u.name} ({u.user_id})")
+                for i, pid in enumerate(photos[:4], start=1)
+            ],
         ),
     )
-    for i, pid in enumerate(photos[:4], start=1):
-        await report_photo_to_control(context, pid, caption=f"📸 Фото {i}\nТочка: {point}\nСотрудник: {u.name} ({u.user_id})")
 
     context.user_data.pop("help_mode", None)
     context.user_data.pop("help_text", None)
@@ -1793,7 +2759,7 @@ async def help_cancel_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not u:
         return
 
-    sess, role = user_open_context(u.user_id)
+    sess, role = await open_context(u.user_id)
     if sess and role:
         await q.edit_message_text("Ок, отменил.", reply_markup=shift_kb(role, normalize_point(sess.point)))
     else:
@@ -1821,7 +2787,7 @@ async def back_shift_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
     u = await guard_employee(update, context)
     if not u:
         return
-    sess, role = user_open_context(u.user_id)
+    sess, role = await open_context(u.user_id)
     if not sess or not role:
         await q.edit_message_text("Смена не открыта.", reply_markup=open_choice_kb())
         return
@@ -1837,14 +2803,14 @@ async def transfer_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
     u = await guard_employee(update, context)
     if not u:
         return
-    sess, role = user_open_context(u.user_id)
+    sess, role = await open_context(u.user_id)
     if not sess or role != "HALF1":
         await q.edit_message_text("Кнопка доступна только первому сотруднику пол-смены.")
         return
     point = normalize_point(sess.point)
 
     # список активных сотрудников на этой точке
-    users = [x for x in list_active_users_all() if x.user_id != u.user_id]
+    users = [x for x in await run_sheets(list_active_users_all) if x.user_id != u.user_id]
     if not users:
         await q.edit_message_text(
             "Нет активных сотрудников на этой точке для передачи.\n"
@@ -1869,7 +2835,7 @@ async def pick_user2_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not u:
         return
 
-    sess, role = user_open_context(u.user_id)
+    sess, role = await open_context(u.user_id)
     if not sess or role != "HALF1":
         await q.edit_message_text("Сейчас ты не в режиме передачи пол-смены.")
         return
@@ -1883,30 +2849,33 @@ async def pick_user2_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await q.edit_message_text("Некорректный выбор.", reply_markup=shift_kb(role, point))
         return
 
-    u2 = get_user(uid2)
+    u2 = await run_sheets(get_user, uid2)
     if not u2 or u2.status != STATUS_ACTIVE:
         await q.edit_message_text("Этот сотрудник сейчас не активен.", reply_markup=shift_kb(role, point))
         return
 
     # проверка косяков по задачам первой половины
-    tasks_all = load_tasks_for_today(point)
+    tasks_all, done_ids = await run_sheets(tasks_with_done_ids, sess.day, point)
     split_index = int(sess.split_index or "0")
     my_tasks = tasks_all[:split_index]
-    done_ids = get_done_task_ids(sess.day, point)
     missing = [t.task_name for t in my_tasks if t.task_id not in done_ids]
 
+    warn = ""
     if missing:
+        # предупреждение уйдёт вместе с итоговым сообщением о передаче, отдельным сообщением не шлём
         warn = "Лично претензий к тебе нет, но косячек с тебя снял! Руководитель будет крайне не доволен!😌\n" \
-               "Задания на сегодня тобою не выполнены."
-        await context.bot.send_message(chat_id=u.user_id, text=warn)
-        await report_to_control(
+               "Задания на сегодня тобою не выполнены.\n\n"
+        report_in_background(
             context,
-            format_control(
-                "⚠️ Косяк при передаче смены (пол смены)",
-                u.name,
-                u.user_id,
-                point=point,
-                details=["Не выполнены задачи первой половины:"] + [f"• {x}" for x in missing[:25]],
+            report_to_control(
+                context,
+                format_control(
+                    "⚠️ Косяк при передаче смены (пол смены)",
+                    u.name,
+                    u.user_id,
+                    point=point,
+                    details=["Не выполнены задачи первой половины:"] + bullet_lines(missing, 25),
+                ),
             ),
         )
 
@@ -1916,36 +2885,43 @@ async def pick_user2_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
     sess.user1_end = ts
     sess.user2_id = str(u2.user_id)
     sess.user2_name = u2.name
-    upsert_session(sess)
+    await run_sheets(upsert_session, sess)
 
-    # отправить запрос принятия user2
-    try:
-        await context.bot.send_message(
+    report_in_background(
+        context,
+        report_to_control(
+            context,
+            format_control(
+                "🔁 Передача смены запрошена",
+                u.name,
+                u.user_id,
+                point=point,
+                details=[f"Кому: {u2.name} ({u2.user_id})", f"Время: {ts}"],
+            ),
+        ),
+    )
+
+    # запрос принятия user2 и ответ user1 — независимые отправки, идут параллельно
+    res_user2, res_edit = await asyncio.gather(
+        context.bot.send_message(
             chat_id=u2.user_id,
             text=f"Тебе передают смену на точке: {point}\nНажми «Принять смену». (Точку выбирать не нужно)",
             reply_markup=InlineKeyboardMarkup([
                 [InlineKeyboardButton("✅ Принять смену", callback_data=f"ACCEPT|{sess.session_id}")]
             ]),
-        )
-    except Exception as e:
-        log.warning("Не смог отправить accept user2: %s", e)
-
-    await report_to_control(
-        context,
-        format_control(
-            "🔁 Передача смены запрошена",
-            u.name,
-            u.user_id,
-            point=point,
-            details=[f"Кому: {u2.name} ({u2.user_id})", f"Время: {ts}"],
         ),
+        q.edit_message_text(
+            warn +
+            "Смену передал ✅\n"
+            "Второй сотрудник должен нажать «Принять смену».",
+            reply_markup=open_choice_kb(),
+        ),
+        return_exceptions=True,
     )
-
-    await q.edit_message_text(
-        "Смену передал ✅\n"
-        "Второй сотрудник должен нажать «Принять смену».",
-        reply_markup=open_choice_kb(),
-    )
+    if isinstance(res_user2, Exception):
+        log.warning("Не смог отправить accept user2: %s", res_user2)
+    if isinstance(res_edit, Exception):
+        log.warning("Не смог обновить сообщение о передаче смены: %s", res_edit)
 
 
 async def accept_shift_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -1969,7 +2945,7 @@ async def accept_shift_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await q.edit_message_text("Некорректный session_id.")
         return
 
-    sess, _idx = get_session(d, point)
+    sess, sess_idx = await run_sheets(get_session, d, point)
     if not sess or sess.session_id != session_id:
         await q.edit_message_text("Смена не найдена или уже закрыта.")
         return
@@ -1981,28 +2957,33 @@ async def accept_shift_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
 
+    point = normalize_point(sess.point)
+
     # Автоматически привязываем сотрудника ко входящей точке смены
-    set_user_point(u.user_id, normalize_point(sess.point))
+    await run_sheets(set_user_point, u.user_id, point)
 
     ts = now_tz().isoformat(timespec="seconds")
     sess.state = "OPEN2"
     sess.user2_start = ts
-    upsert_session(sess)
+    await run_sheets(upsert_session, sess, idx=sess_idx)
 
-    await report_to_control(
+    report_in_background(
         context,
-        format_control(
-            "✅ Смена принята (пол смены)",
-            u.name,
-            u.user_id,
-            point=normalize_point(sess.point),
-            details=[f"Время: {ts}", f"От кого: {sess.user1_name} ({sess.user1_id})"],
+        report_to_control(
+            context,
+            format_control(
+                "✅ Смена принята (пол смены)",
+                u.name,
+                u.user_id,
+                point=point,
+                details=[f"Время: {ts}", f"От кого: {sess.user1_name} ({sess.user1_id})"],
+            ),
         ),
     )
 
     await q.edit_message_text(
-        f"Смена принята ✅\nТочка: {normalize_point(sess.point)}",
-        reply_markup=shift_kb("HALF2", normalize_point(sess.point)),
+        f"Смена принята ✅\nТочка: {point}",
+        reply_markup=shift_kb("HALF2", point),
     )
 
 
@@ -2017,7 +2998,7 @@ async def close_start_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not u:
         return ConversationHandler.END
 
-    sess, role = user_open_context(u.user_id)
+    sess, role = await open_context(u.user_id)
     if not sess or not role:
         await q.edit_message_text("Смена не открыта.")
         return ConversationHandler.END
@@ -2091,7 +3072,7 @@ async def close_refunds(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 async def close_receipt1(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    u = get_user(update.effective_user.id)
+    u = await run_sheets(get_user, update.effective_user.id)
     if not u or u.status != STATUS_ACTIVE:
         await update.message.reply_text("Нет доступа.")
         return ConversationHandler.END
@@ -2102,12 +3083,12 @@ async def close_receipt1(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return RECEIPT1
 
     context.user_data["close"]["receipt1"] = file_id
-    await update.message.reply_text("Принял ✅ Теперь пришли фото 2 чека закрытия смены 📸")
+    await album_ack(update, context, "Принял ✅ Теперь пришли фото 2 чека закрытия смены 📸")
     return RECEIPT2
 
 
 async def close_receipt2(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    u = get_user(update.effective_user.id)
+    u = await run_sheets(get_user, update.effective_user.id)
     if not u or u.status != STATUS_ACTIVE:
         await update.message.reply_text("Нет доступа.")
         return ConversationHandler.END
@@ -2118,15 +3099,17 @@ async def close_receipt2(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return RECEIPT2
 
     context.user_data["close"]["receipt2"] = file_id
-    await update.message.reply_text(
-        "Принял ✅\n\nТеперь пришли 4 фото убранного рабочего места и инвентаря (по одному сообщению). Фото 1/4 📸"
+    await album_ack(
+        update,
+        context,
+        "Принял ✅\n\nТеперь пришли 4 фото убранного рабочего места и инвентаря (по одному сообщению). Фото 1/4 📸",
     )
     context.user_data["close"]["cleanup"] = []
     return CLEANUP
 
 
 async def close_cleanup(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    u = get_user(update.effective_user.id)
+    u = await run_sheets(get_user, update.effective_user.id)
     if not u or u.status != STATUS_ACTIVE:
         await update.message.reply_text("Нет доступа.")
         return ConversationHandler.END
@@ -2139,8 +3122,9 @@ async def close_cleanup(update: Update, context: ContextTypes.DEFAULT_TYPE):
     cl = context.user_data["close"]["cleanup"]
     cl.append(file_id)
     if len(cl) < 4:
-        await update.message.reply_text(f"Принял ✅ Фото {len(cl)}/4. Жду следующее.")
+        await album_ack(update, context, f"Принял ✅ Фото {len(cl)}/4. Жду следующее.")
         return CLEANUP
+    drop_album_ack(update, context)
 
     # ФИНАЛИЗАЦИЯ
     close_ctx = context.user_data["close"]
@@ -2156,18 +3140,17 @@ async def close_cleanup(update: Update, context: ContextTypes.DEFAULT_TYPE):
     cash_in_box = cash_in + sales_cash
 
     # задачи по всей смене на точке (и для FULL, и для HALF2 при итоговом закрытии)
-    tasks_all = load_tasks_for_today(point)
-    done_ids = get_done_task_ids(day, point)
+    tasks_all, done_ids = await run_sheets(tasks_with_done_ids, day, point)
     missing = [t.task_name for t in tasks_all if t.task_id not in done_ids]
 
     note = ""
     if missing:
         note = "MISSING_TASKS"
 
-    # лог close_log
+    # лог close_log (запись отложенная, как у done_log)
     ts = now_tz().isoformat(timespec="seconds")
     cleanup = cl[:4]
-    sheet_append(
+    enqueue_append(
         SHEET_CLOSE,
         [
             ts, day, point, session_id, mode,
@@ -2179,9 +3162,10 @@ async def close_cleanup(update: Update, context: ContextTypes.DEFAULT_TYPE):
             note,
         ],
     )
+    request_append_flush(context)
 
     # закрыть сессию
-    sess, _ = get_session(day, point)
+    sess, sess_idx = await run_sheets(get_session, day, point)
     if sess and sess.session_id == session_id:
         sess.state = "CLOSED"
         if mode == "FULL":
@@ -2192,7 +3176,7 @@ async def close_cleanup(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 sess.user1_end = ts
             else:
                 sess.user2_end = ts
-        upsert_session(sess)
+        await run_sheets(upsert_session, sess, idx=sess_idx)
 
     # сообщение пользователю
     if missing:
@@ -2218,26 +3202,28 @@ async def close_cleanup(update: Update, context: ContextTypes.DEFAULT_TYPE):
         f"Наличные в кассе {cash_in_box} (внесение+наличные)\n"
         f"Время: {ts}"
     )
-    await report_to_control(context, summary)
-
-    # фото: 2 чека
-    await report_photo_to_control(context, close_ctx["receipt1"], caption=f"🧾 Чек 1\nТочка: {point}\nСотрудник: {u.name} ({u.user_id})")
-    await report_photo_to_control(context, close_ctx["receipt2"], caption=f"🧾 Чек 2\nТочка: {point}\nСотрудник: {u.name} ({u.user_id})")
-    # фото: уборка 4
-    for i, pid in enumerate(cleanup, start=1):
-        await report_photo_to_control(context, pid, caption=f"🧹 Уборка {i}/4\nТочка: {point}\nСотрудник: {u.name} ({u.user_id})")
-
+    reports = [
+        # сводка — подписью к альбому: 2 чека + уборка 4
+        report_with_photos_to_control(context, summary, [
+            (close_ctx["receipt1"], f"🧾 Чек 1\nТочка: {point}\nСотрудник: {u.name} ({u.user_id})"),
+            (close_ctx["receipt2"], f"🧾 Чек 2\nТочка: {point}\nСотрудник: {u.name} ({u.user_id})"),
+        ] + [
+            (pid, f"🧹 Уборка {i}/4\nТочка: {point}\nСотрудник: {u.name} ({u.user_id})")
+            for i, pid in enumerate(cleanup, start=1)
+        ]),
+    ]
     if missing:
-        await report_to_control(
+        reports.append(report_to_control(
             context,
             format_control(
                 "⚠️ Косяк: задачи не выполнены к закрытию смены",
                 u.name,
                 u.user_id,
                 point=point,
-                details=["Не выполнены:"] + [f"• {x}" for x in missing[:30]],
+                details=["Не выполнены:"] + bullet_lines(missing, 30),
             ),
-        )
+        ))
+    report_in_background(context, *reports)
 
     # очистить контекст
     context.user_data.pop("close", None)
@@ -2253,26 +3239,146 @@ async def close_cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
 # -------------------- REMINDERS --------------------
 
 
+# Темп отправки держит AIORateLimiter; семафор только ограничивает число одновременных запросов
+# (общий для всех рассылок тика: уведомления о закрытии и напоминания идут параллельно)
+SEND_CONCURRENCY = 20
+_send_sem = asyncio.Semaphore(SEND_CONCURRENCY)
+
+
+async def _send_one(chat_id: int, coro, what: str):
+    async with _send_sem:
+        try:
+            await coro
+        except Exception as e:
+            log.warning("Не смог отправить %s %s: %s", what, chat_id, e)
+
+
+async def send_bounded(sends: List[Tuple[int, Any]], what: str):
+    """Отправляет корутины (chat_id, coro) параллельно, не больше SEND_CONCURRENCY сразу; ошибки только логируем.
+
+    В отличие от пачек, медленная отправка не держит остальные: освободившийся слот сразу занимает следующая.
+    """
+    await asyncio.gather(*(_send_one(chat_id, coro, what) for chat_id, coro in sends))
+
+
 REMINDER_TEXT = "Дружище, ты же помнишь о задачах? Давай не будем подводить друг друга и закроем план! 🙂"
 CLOSE_AVAILABLE_TEXT = "🔒 Кнопка «Закрыть смену» теперь доступна. Нажми её, чтобы закрыть смену."
 
 
+def reminder_flag(day: str, point: str, user_id: int) -> str:
+    """Ключ в bot_data: когда сотруднику последний раз напоминали (или он отметил задачу)."""
+    return f"reminder_sent:{day}:{point}:{user_id}"
+
+
+def _reminder_due(context: ContextTypes.DEFAULT_TYPE, flag: str, now: Optional[datetime] = None) -> bool:
+    """throttling: не чаще чем раз в REMINDER_IDLE_MINUTES для (день/точка/сотрудник)."""
+    last = context.bot_data.get(flag)  # ISO timestamp
+    if not last:
+        return True
+    try:
+        return (now or now_tz()) - datetime.fromisoformat(last) >= REMINDER_IDLE
+    except Exception:
+        return True
+
+
+# флаги в bot_data: reminder_sent:{day}:{point}:{uid} и close_notified:{day}|{point}:{uid}
+_FLAG_PREFIXES = ("reminder_sent:", "close_notified:")
+
+
+def prune_day_flags(bot_data: Dict[Any, Any], today: str):
+    """Флаги живут только в памяти; раз в сутки выкидываем прошедшие дни, чтобы bot_data не рос бесконечно."""
+    if bot_data.get("flags_day") == today:
+        return
+    for k in [k for k in bot_data if isinstance(k, str) and k.startswith(_FLAG_PREFIXES)]:
+        if k.split(":", 2)[1][:10] != today:
+            del bot_data[k]
+    bot_data["flags_day"] = today
+
+
+def prefetch_tick_rows(with_tasks: bool):
+    """Всё, что тику понадобится и устарело (shift_sessions, а в рабочие часы ещё cleaning_schedule
+    и новые строки done_log), читаем одним batchGet и кладём в обычные кэши; дальше они отдают без запросов."""
+    now = monotonic()
+    ranges: List[str] = []
+    if cache_stale(_sessions_cache, SESSIONS_CACHE_TTL_SECONDS):
+        ranges.append(SHEET_SESSIONS)
+    done_range = None
+    if with_tasks:
+        if cache_stale(_schedule_cache, SCHEDULE_CACHE_TTL_SECONDS):
+            ranges.append(SHEET_SCHEDULE)
+        since = _done_since()
+        if _done_cache["rows"] is not None and _done_cache["since"] != since:
+            with _done_read_lock:
+                _done_cache_roll(since)
+        # холодное чтение (два шага, см. _done_read_recent) batchGet не объединить — его делает load_done_rows
+        if _done_tail_ok(now) and now - _done_cache["at"] > DONE_CACHE_TTL_SECONDS:
+            done_start = _done_cache["next_row"]
+            done_range, done_base = done_read_range(done_start), _done_cache["rows"]
+        if done_range:
+            ranges.append(done_range)
+    if len(ranges) < 2:
+        return  # один диапазон обычный загрузчик прочитает сам
+    try:
+        got = dict(zip(ranges, sheet_batch_get(ranges)))
+    except Exception as e:
+        log.warning("batchGet для напоминаний не прошёл, читаю по отдельности: %s", e)
+        return
+    if SHEET_SESSIONS in got:
+        _sessions_cache.update(rows=got[SHEET_SESSIONS], at=monotonic(), index=None)
+    if SHEET_SCHEDULE in got:
+        _schedule_cache.update(rows=got[SHEET_SCHEDULE], at=monotonic(), tasks={}, today=None)
+    if done_range:
+        with _done_read_lock:
+            _done_cache_store(got[done_range], done_start, since, base=done_base)
+
+
+def load_reminder_rows(day: str) -> Tuple[List[List[str]], Dict[str, frozenset[str]], Dict[Tuple[str, str], str]]:
+    """cleaning_schedule и выжимка done_log за day для тика (листы обычно уже в кэше после prefetch_tick_rows).
+
+    Индекс done_log (и его _done_index_lock) трогаем только здесь, в потоке Sheets: циклу отдаём
+    собственные копии — закрытые task_id по точкам и время последней отметки по (точка, user_id).
+    """
+    ids, last = _done_index(load_done_rows() or [])
+    done_by_point = {p: frozenset(v) for (d, p), v in ids.items() if d == day}
+    last_by_user = {(p, uid): ts for (d, p, uid), ts in last.items() if d == day}
+    return load_schedule_rows(), done_by_point, last_by_user
+
+
+def _any_point_working(now: datetime) -> bool:
+    t = now.time()
+    return any(start <= t <= end for start, end in (*WORK_HOURS.values(), DEFAULT_WORK_HOURS))
+
+
+def _idle_since_start(sess: Session, role: str, now: datetime) -> bool:
+    """Прошло ли REMINDER_IDLE от начала смены этого сотрудника (нечитаемое время старта — не пинаем)."""
+    start_ts_str = sess.user1_start if role in ("FULL", "HALF1") else sess.user2_start
+    try:
+        start_ts = datetime.fromisoformat(start_ts_str)
+    except Exception:
+        return False
+    return now - start_ts >= REMINDER_IDLE
+
+
 async def reminders_job(context: ContextTypes.DEFAULT_TYPE):
     if not ENABLE_REMINDERS:
         return
 
-    d = day_key()
-    sessions = list_open_sessions()
+    # одно «сейчас» на весь тик: все сравнения с ним и отметки в bot_data согласованы
+    now = now_tz()
+    now_iso = now.isoformat(timespec="seconds")
+    d = now.date().isoformat()
+    prune_day_flags(context.bot_data, d)
+    await run_sheets(prefetch_tick_rows, _any_point_working(now))
+    sessions = [s for s in await run_sheets(list_open_sessions) if s.day == d]
     if not sessions:
         return
 
     # Пушим сотруднику актуальное меню с кнопкой закрытия в момент окончания смены.
     # (иначе у второго сотрудника «закрыть смену» не появится, если он принял смену раньше конца)
+    close_sends: List[Tuple[int, Any]] = []
     for s in sessions:
-        if s.day != d:
-            continue
         point = normalize_point(s.point)
-        if not can_close_now(point):
+        if not can_close_now(point, now):
             continue
         notify_uid = None
         notify_role = None
@@ -2288,40 +3394,47 @@ async def reminders_job(context: ContextTypes.DEFAULT_TYPE):
         if context.bot_data.get(flag_key):
             continue
         context.bot_data[flag_key] = True
-        try:
-            await context.bot.send_message(
+        close_sends.append((
+            notify_uid,
+            context.bot.send_message(
                 chat_id=notify_uid,
                 text=CLOSE_AVAILABLE_TEXT,
                 reply_markup=shift_kb(notify_role, point),
-            )
-        except Exception as e:
-            log.warning("Не смог отправить уведомление о закрытии %s: %s", notify_uid, e)
+            ),
+        ))
 
+    reminder_sends: List[Tuple[int, Any]] = []
+    # cleaning_schedule и done_log читаем один раз за проход и только если они нужны
+    schedule_rows = None
+    done_by_point: Dict[str, frozenset[str]] = {}
+    last_by_user: Dict[Tuple[str, str], str] = {}
     for s in sessions:
-        if s.day != d:
-            continue
         point = normalize_point(s.point)
-        if not in_work_hours(point):
+        if not in_work_hours(point, now):
             continue
 
-        # кто сейчас отвечает за задачи
-        targets: List[Tuple[int, str]] = []
-        if s.mode == "FULL" and s.state == "OPEN_FULL" and s.user1_id:
-            targets.append((int(s.user1_id), "FULL"))
-        elif s.mode == "HALF":
-            if s.state == "OPEN1" and s.user1_id:
-                targets.append((int(s.user1_id), "HALF1"))
-            elif s.state == "OPEN2" and s.user2_id:
-                targets.append((int(s.user2_id), "HALF2"))
-            else:
-                continue
+        # кто сейчас отвечает за задачи — те же правила, что у индекса открытых смен
+        targets = [(int(uid), role) for uid, role in _session_roles(s) if uid]
+        if not targets:
+            continue
+
+        # отметка последнего пинга в bot_data — это и есть «дедлайн» следующего напоминания;
+        # проверяем её до чтения листов: в большинстве тиков никому ещё рано
+        due = [(uid, role, reminder_flag(d, point, uid)) for uid, role in targets]
+        due = [t for t in due if _reminder_due(context, t[2], now)]
+        # смена началась меньше REMINDER_IDLE назад — отметки (если есть) ещё свежее, листы не нужны
+        due = [t for t in due if _idle_since_start(s, t[1], now)]
+        if not due:
+            continue
 
-        tasks_all = load_tasks_for_today(point)
+        if schedule_rows is None:
+            schedule_rows, done_by_point, last_by_user = await run_sheets(load_reminder_rows, d)
+        tasks_all = tasks_for_today_shared(point, rows=schedule_rows)
         if not tasks_all:
             continue
 
-        done_ids = get_done_task_ids(d, point)
-        for uid, role in targets:
+        done_ids = done_by_point.get(point, frozenset())
+        for uid, role, flag in due:
             # определить задачи для роли
             if role == "FULL":
                 tasks = tasks_all
@@ -2329,40 +3442,22 @@ async def reminders_job(context: ContextTypes.DEFAULT_TYPE):
                 split_index = int(s.split_index or "0")
                 tasks = tasks_all[:split_index] if role == "HALF1" else tasks_all[split_index:]
 
-            remaining = [t for t in tasks if t.task_id not in done_ids]
-            if not remaining:
+            if all(t.task_id in done_ids for t in tasks):
                 continue
 
-            last_ts = last_task_action_ts(d, point, uid)
-            if last_ts is None:
-                # если не делал ничего и прошло >= idle от старта его смены
-                start_ts_str = s.user1_start if role in ("FULL", "HALF1") else s.user2_start
-                try:
-                    start_ts = datetime.fromisoformat(start_ts_str)
-                except Exception:
-                    start_ts = now_tz()
-                if now_tz() - start_ts < timedelta(minutes=REMINDER_IDLE_MINUTES):
-                    continue
-            else:
-                if now_tz() - last_ts < timedelta(minutes=REMINDER_IDLE_MINUTES):
-                    continue
+            # от старта смены idle уже прошёл (проверено выше); осталось — от последней отметки
+            last_ts = parse_action_ts(last_by_user.get((point, str(uid))))
+            if last_ts is not None and now - last_ts < REMINDER_IDLE:
+                continue
 
-            # throttling: не чаще чем раз в REMINDER_IDLE_MINUTES для (день/точка/сотрудник)
-            flag = f"reminder_sent:{d}:{point}:{uid}"
-            last = context.bot_data.get(flag)  # ISO timestamp
-            if last:
-                try:
-                    last_dt = datetime.fromisoformat(last)
-                    if now_tz() - last_dt < timedelta(minutes=REMINDER_IDLE_MINUTES):
-                        continue
-                except Exception:
-                    pass
-            context.bot_data[flag] = now_tz().isoformat(timespec="seconds")
+            context.bot_data[flag] = now_iso
+            reminder_sends.append((uid, context.bot.send_message(chat_id=uid, text=REMINDER_TEXT)))
 
-            try:
-                await context.bot.send_message(chat_id=uid, text=REMINDER_TEXT)
-            except Exception as e:
-                log.warning("Не смог отправить напоминание %s: %s", uid, e)
+    # обе рассылки тика уходят одним параллельным проходом
+    await asyncio.gather(
+        send_bounded(close_sends, "уведомление о закрытии"),
+        send_bounded(reminder_sends, "напоминание"),
+    )
 
 
 # -------------------- ERROR HANDLER --------------------
@@ -2375,33 +3470,88 @@ async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE):
 # -------------------- HEALTH SERVER (polling mode) --------------------
 
 
-class HealthHandler(BaseHTTPRequestHandler):
-    def do_GET(self):
-        if self.path not in ("/", "/health", "/healthz"):
-            self.send_response(404)
-            self.end_headers()
-            return
-        self.send_response(200)
-        self.send_header("Content-type", "text/plain; charset=utf-8")
-        self.end_headers()
-        self.wfile.write(b"OK")
+async def health(_request: web.Request) -> web.Response:
+    return web.Response(text="OK")
 
 
-def start_health_server():
-    if not ENABLE_HEALTH:
-        return
+def add_health_routes(aio: web.Application):
+    for path in ("/", "/health", "/healthz"):
+        aio.router.add_get(path, health)
+
 
-    def _run():
-        srv = HTTPServer((HEALTH_HOST, HEALTH_PORT), HealthHandler)
-        log.info("Health: http://%s:%s/healthz", HEALTH_HOST, HEALTH_PORT)
-        srv.serve_forever()
+_health_state: Dict[str, Optional[web.AppRunner]] = {"runner": None}
 
-    threading.Thread(target=_run, daemon=True).start()
+
+async def start_health_server():
+    """В polling-режиме health отдаёт тот же event loop, что и бот (в webhook-режиме маршруты в общем aiohttp-приложении)."""
+    if not ENABLE_HEALTH or _health_state["runner"] is not None:
+        return
+    aio = web.Application()
+    add_health_routes(aio)
+    runner = web.AppRunner(aio, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, HEALTH_HOST, HEALTH_PORT).start()
+    _health_state["runner"] = runner
+    log.info("Health: http://%s:%s/healthz", HEALTH_HOST, HEALTH_PORT)
+
+
+async def stop_health_server():
+    runner = _health_state["runner"]
+    if runner is None:
+        return
+    _health_state["runner"] = None
+    await runner.cleanup()
 
 
 # -------------------- APP BUILD --------------------
 
 
+class PerChatUpdateProcessor(BaseUpdateProcessor):
+    """Апдейты разных чатов — параллельно, одного чата — строго по очереди.
+
+    Без этого один медленный обработчик (запрос к Sheets, отправка фото) задерживал всех сотрудников.
+    ConversationHandler и user_data рассчитаны на последовательные апдейты одного пользователя —
+    очередь на чат это сохраняет.
+    """
+
+    # семафор базового класса берётся до do_process_update — апдейты, ждущие свой чат, занимали бы его
+    # слоты; поэтому он фактически без ограничения, а лимит — свой, и берётся уже после очереди чата
+    _UNBOUNDED = 1 << 16
+
+    def __init__(self, max_concurrent_updates: int):
+        super().__init__(self._UNBOUNDED)
+        self._slots = asyncio.BoundedSemaphore(max_concurrent_updates)
+        # chat_id -> [lock, сколько апдейтов его держат или ждут]; запись удаляем, когда апдейтов чата нет
+        self._chat_locks: Dict[Any, List[Any]] = {}
+
+    async def do_process_update(self, update: object, coroutine: Any) -> None:
+        key = None
+        if isinstance(update, Update):
+            chat = update.effective_chat
+            user = update.effective_user
+            key = chat.id if chat else (("user", user.id) if user else None)
+        if key is None:
+            async with self._slots:
+                await coroutine
+            return
+        entry = self._chat_locks.setdefault(key, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                async with self._slots:
+                    await coroutine
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._chat_locks[key]
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+
 # -------------------- DAILY TOTALS (23:50) --------------------
 
 def _to_float(x: Any) -> float:
@@ -2425,6 +3575,10 @@ def _fmt_money(v: float) -> str:
         return "0"
 
 
+# для итогов нужны timestamp..cash_in_box (A..M); file_id чеков/уборки — самые длинные ячейки листа, их не тянем
+CLOSE_TOTALS_RANGE = f"{SHEET_CLOSE}!A1:M"
+
+
 def collect_daily_totals(day: str) -> Tuple[List[str], Dict[str, Dict[str, float]]]:
     """Берём ПОСЛЕДНЕЕ закрытие на точке за день (по timestamp) и считаем итоги по точкам."""
     points = [normalize_point(p) for p in load_points()]
@@ -2440,7 +3594,12 @@ def collect_daily_totals(day: str) -> Tuple[List[str], Dict[str, Dict[str, float
         } for p in points
     }
 
-    rows = sheet_get(SHEET_CLOSE)
+    # закрытия, которые ещё стоят в очереди на запись, тоже должны попасть в итоги
+    try:
+        flush_appends()
+    except Exception as e:
+        log.warning("Не смог дописать close_log перед итогами: %s", e)
+    rows = sheet_get(CLOSE_TOTALS_RANGE)
     if not rows:
         return points, metrics
 
@@ -2640,8 +3799,16 @@ def build_totals_messages_compact(day: str, points: List[str], metrics: Dict[str
     return tables, total_sales, cash_in_box
 
 
+# внутри <pre> достаточно экранировать &, < и > — одним проходом через translate
+_HTML_PRE_TABLE = str.maketrans({"&": "&amp;", "<": "&lt;", ">": "&gt;"})
+
+
+def html_escape_pre(text: str) -> str:
+    return text.translate(_HTML_PRE_TABLE)
+
+
 async def _send_pre_table(bot, chat_id: int, header: str, table_text: str):
-    payload = html.escape(table_text)
+    payload = html_escape_pre(table_text)
     text = header + "\n<pre>" + payload + "</pre>"
 
     if len(text) <= 3900:
@@ -2675,7 +3842,7 @@ async def daily_totals_job(context: ContextTypes.DEFAULT_TYPE):
         return
 
     d = day_key()
-    points, metrics = collect_daily_totals(d)
+    points, metrics = await run_sheets(collect_daily_totals, d)
     if not metrics:
         return
 
@@ -2715,7 +3882,7 @@ async def cmd_totals(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 await update.effective_message.reply_text("Формат: /totals [вчера|yesterday|YYYY-MM-DD]")
                 return
 
-    points, metrics = collect_daily_totals(d)
+    points, metrics = await run_sheets(collect_daily_totals, d)
     if not metrics:
         await update.effective_message.reply_text(f"Нет данных за {d}.")
         return
@@ -2729,6 +3896,87 @@ async def cmd_totals(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
 
 
+def warm_caches():
+    """Первое обновление после рестарта не должно ждать чтения users/shift_sessions/графика."""
+    _users_rows()
+    _sessions_rows()
+    load_schedule_rows()
+
+
+async def post_init(_app: Application):
+    if not WEBHOOK_MODE:
+        # до прогрева кэша: health должен отвечать сразу после старта процесса
+        try:
+            await start_health_server()
+        except Exception as e:
+            log.warning("Не смог запустить health-сервер: %s", e)
+    try:
+        await run_sheets(warm_caches)
+    except Exception as e:
+        log.warning("Не смог прогреть кэш таблиц: %s", e)
+
+
+async def post_shutdown(_app: Application):
+    # не теряем строки логов, которые не успели уйти в таблицу
+    try:
+        await run_sheets(flush_appends)
+    except Exception as e:
+        log.warning("Не смог дописать логи при остановке: %s", e)
+    await stop_health_server()
+
+
+# -------------------- CALLBACK ROUTES --------------------
+# Обычные кнопки разбираются одним обработчиком по таблице (поиск в dict), а не цепочкой
+# CallbackQueryHandler с regex на каждую кнопку. Регулярки остаются только у входов в ConversationHandler.
+
+RE_OPEN_MODE = re.compile(r"^OPEN\|(FULL|HALF)$")
+RE_CLOSE = re.compile(r"^CLOSE$")
+
+# callback_data целиком
+CALLBACK_ROUTES = {
+    "CHOOSE_POINT": choose_point_cb,
+    "BACK_TO_POINT": back_to_point_cb,
+    "PLAN": plan_cb,
+    "MARK": mark_cb,
+    "SKIP_TASK_PHOTO2": skip_task_photo2_cb,
+    "HELP": help_cb,
+    "HELP_SEND": help_send_cb,
+    "HELP_CANCEL": help_cancel_cb,
+    "TRANSFER": transfer_cb,
+    "BACK_MAIN": back_main_cb,
+    "BACK_SHIFT": back_shift_cb,
+}
+# "PREFIX|...": (обработчик, после | должно быть число)
+CALLBACK_PREFIX_ROUTES = {
+    "ADM": (admin_cb, False),
+    "POINT": (point_pick_cb, True),
+    "OPEN": (open_cb, False),  # OPEN|FULL и OPEN|HALF раньше забирает open_full_conv
+    "TASK": (task_pick_cb, True),
+    "U2": (pick_user2_cb, True),
+    "ACCEPT": (accept_shift_cb, False),
+}
+
+
+def callback_route(data: object) -> Optional[Any]:
+    if not isinstance(data, str):
+        return None
+    handler = CALLBACK_ROUTES.get(data)
+    if handler is not None:
+        return handler
+    prefix, sep, rest = data.partition("|")
+    route = CALLBACK_PREFIX_ROUTES.get(prefix) if sep else None
+    if route is None:
+        return None
+    handler, numeric = route
+    if numeric and not rest.isdecimal():
+        return None
+    return handler
+
+
+async def dispatch_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await callback_route(update.callback_query.data)(update, context)
+
+
 def build_app() -> Application:
     require_env()
 
@@ -2743,7 +3991,33 @@ def build_app() -> Application:
             f"\nОшибка: {e}"
         ) from e
 
-    app = Application.builder().token(BOT_TOKEN).build()
+    # Лимиты Telegram: ~30 сообщений/сек на бота и ~20/мин в группу (с запасом), 429 — повтор до 3 раз
+    rate_limiter = AIORateLimiter(
+        overall_max_rate=28,
+        overall_time_period=1,
+        group_max_rate=18,
+        group_time_period=60,
+        max_retries=3,
+    )
+    # Пул соединений под параллельные рассылки (gather), HTTP/2 — мультиплексирование на одном соединении
+    builder = (
+        Application.builder()
+        .token(BOT_TOKEN)
+        .rate_limiter(rate_limiter)
+        .connection_pool_size(64)
+        .connect_timeout(5)
+        .read_timeout(20)
+        .pool_timeout(1.0)
+        .http_version("2")
+        .concurrent_updates(PerChatUpdateProcessor(UPDATE_CONCURRENCY))
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+    )
+    if WEBHOOK_MODE:
+        # апдейты приходят в webhook_handler → update_queue; Updater с отдельным
+        # HTTP-клиентом под getUpdates в этом режиме не нужен
+        builder = builder.updater(None)
+    app = builder.build()
 
     # Registration conversation
     reg_conv = ConversationHandler(
@@ -2756,22 +4030,15 @@ def build_app() -> Application:
     )
     app.add_handler(reg_conv)
 
-    # Admin commands & buttons
-    app.add_handler(CallbackQueryHandler(admin_cb, pattern=r"^ADM\|"))
+    # Admin commands
     app.add_handler(CommandHandler("block", cmd_block))
     app.add_handler(CommandHandler("totals", cmd_totals))
     app.add_handler(CommandHandler("unblock", cmd_unblock))
     app.add_handler(CommandHandler("pending", cmd_pending))
 
-    # Employee callbacks
-    app.add_handler(CallbackQueryHandler(choose_point_cb, pattern=r"^CHOOSE_POINT$"))
-    app.add_handler(CallbackQueryHandler(point_pick_cb, pattern=r"^POINT\|\d+$"))
-    app.add_handler(CallbackQueryHandler(back_to_point_cb, pattern=r"^BACK_TO_POINT$"))
-
-
     # Open FULL shift conversation (report -> showcase photo -> macarons photo)
     open_full_conv = ConversationHandler(
-        entry_points=[CallbackQueryHandler(open_full_start_cb, pattern=r"^OPEN\|(FULL|HALF)$")],
+        entry_points=[CallbackQueryHandler(open_full_start_cb, pattern=RE_OPEN_MODE)],
         states={
             OPEN_FULL_REPORT: [MessageHandler(filters.TEXT & ~filters.COMMAND, open_full_report_text)],
             OPEN_FULL_SHOWCASE: [
@@ -2787,28 +4054,15 @@ def build_app() -> Application:
         allow_reentry=True,
     )
     app.add_handler(open_full_conv)
-    app.add_handler(CallbackQueryHandler(open_cb, pattern=r"^OPEN\|"))
-
-    app.add_handler(CallbackQueryHandler(plan_cb, pattern=r"^PLAN$"))
-    app.add_handler(CallbackQueryHandler(mark_cb, pattern=r"^MARK$"))
-    app.add_handler(CallbackQueryHandler(task_pick_cb, pattern=r"^TASK\|\d+$"))
-    app.add_handler(CallbackQueryHandler(skip_task_photo2_cb, pattern=r"^SKIP_TASK_PHOTO2$"))
+    # Кнопки админов и сотрудников (кроме входов в сценарии выше/ниже) — один обработчик с таблицей маршрутов;
+    # стоит после open_full_conv, чтобы OPEN|FULL / OPEN|HALF доставались сценарию
+    app.add_handler(CallbackQueryHandler(dispatch_callback, pattern=callback_route))
 
-    app.add_handler(CallbackQueryHandler(help_cb, pattern=r"^HELP$"))
-    app.add_handler(CallbackQueryHandler(help_send_cb, pattern=r"^HELP_SEND$"))
-    app.add_handler(CallbackQueryHandler(help_cancel_cb, pattern=r"^HELP_CANCEL$"))
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, help_text_message), group=1)
 
-    app.add_handler(CallbackQueryHandler(transfer_cb, pattern=r"^TRANSFER$"))
-    app.add_handler(CallbackQueryHandler(pick_user2_cb, pattern=r"^U2\|\d+$"))
-    app.add_handler(CallbackQueryHandler(accept_shift_cb, pattern=r"^ACCEPT\|"))
-
-    app.add_handler(CallbackQueryHandler(back_main_cb, pattern=r"^BACK_MAIN$"))
-    app.add_handler(CallbackQueryHandler(back_shift_cb, pattern=r"^BACK_SHIFT$"))
-
     # Close shift conversation
     close_conv = ConversationHandler(
-        entry_points=[CallbackQueryHandler(close_start_cb, pattern=r"^CLOSE$")],
+        entry_points=[CallbackQueryHandler(close_start_cb, pattern=RE_CLOSE)],
         states={
             CASH_IN: [MessageHandler(filters.TEXT & ~filters.COMMAND, close_cash_in)],
             SALES_CASHLESS: [MessageHandler(filters.TEXT & ~filters.COMMAND, close_sales_cashless)],
@@ -2828,6 +4082,10 @@ def build_app() -> Application:
 
     app.add_error_handler(error_handler)
 
+    # Повтор незаписанных строк логов
+    if app.job_queue:
+        app.job_queue.run_repeating(append_retry_job, interval=APPEND_RETRY_SECONDS, first=APPEND_RETRY_SECONDS, name="append_retry")
+
     # Reminders
     if ENABLE_REMINDERS and app.job_queue:
         interval = max(1, REMINDER_CHECK_MINUTES) * 60
@@ -2839,8 +4097,9 @@ def build_app() -> Application:
     # Daily totals at 23:50 (local TIME_ZONE)
     if ENABLE_DAILY_TOTALS and app.job_queue:
         try:
-            t = time(DAILY_TOTALS_HOUR, DAILY_TOTALS_MINUTE)
-            app.job_queue.run_daily(daily_totals_job, time=t, timezone=_tz, name="daily_totals_2350")
+            # часовой пояс задаётся через tzinfo самого time (с zoneinfo он корректен, в отличие от pytz)
+            t = time(DAILY_TOTALS_HOUR, DAILY_TOTALS_MINUTE, tzinfo=_tz)
+            app.job_queue.run_daily(daily_totals_job, time=t, name="daily_totals_2350")
             log.info("Daily totals enabled: %02d:%02d (%s)", DAILY_TOTALS_HOUR, DAILY_TOTALS_MINUTE, TIME_ZONE)
         except Exception as e:
             log.warning("Daily totals schedule failed: %s", e)
@@ -2869,12 +4128,11 @@ def main():
         port = int(os.getenv("PORT", "10000"))
         path = WEBHOOK_PATH
 
-        async def health(_request: web.Request) -> web.Response:
-            return web.Response(text="OK")
-
         async def webhook_handler(request: web.Request) -> web.Response:
+            if WEBHOOK_SECRET and request.headers.get("X-Telegram-Bot-Api-Secret-Token") != WEBHOOK_SECRET:
+                return web.Response(status=403, text="forbidden")
             try:
-                data = await request.json()
+                data = await request.json(loads=orjson.loads)
             except Exception:
                 return web.Response(status=400, text="bad json")
 
@@ -2888,24 +4146,25 @@ def main():
 
         async def on_startup(_app: web.Application):
             await tg_app.initialize()
+            # post_init сам вызывается только в run_polling/run_webhook
+            await post_init(tg_app)
             await tg_app.start()
 
             url = f"{WEBHOOK_BASE_URL.rstrip('/')}/{path.lstrip('/')}"
             await tg_app.bot.set_webhook(
                 url=url,
                 drop_pending_updates=False,
-                allowed_updates=Update.ALL_TYPES,
+                allowed_updates=ALLOWED_UPDATES,
+                secret_token=WEBHOOK_SECRET or None,
             )
             log.info("Webhook mode ON: %s  port=%s", url, port)
 
         async def on_cleanup(_app: web.Application):
             # Важно: не дергать stop/shutdown, чтобы не удалять webhook на Render
-            return
+            await post_shutdown(tg_app)
 
         aio = web.Application()
-        aio.router.add_get("/", health)
-        aio.router.add_get("/health", health)
-        aio.router.add_get("/healthz", health)
+        add_health_routes(aio)
         aio.router.add_post(f"/{path}", webhook_handler)
         aio.on_startup.append(on_startup)
         aio.on_cleanup.append(on_cleanup)
@@ -2913,8 +4172,7 @@ def main():
         web.run_app(aio, host="0.0.0.0", port=port)
     else:
         log.info("Polling mode ON")
-        start_health_server()
-        tg_app.run_polling(allowed_updates=Update.ALL_TYPES, drop_pending_updates=True)
+        tg_app.run_polling(allowed_updates=ALLOWED_UPDATES, drop_pending_updates=True)
 
 
 if __name__ == "__main__":